@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+import argparse
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+from typing import Callable
+
+import numpy as np
+
+# Each parsed beam log is a dir <hash>/ with one .npy per array, mapped on the next runs.
+# The dir and the size cap (bytes, 0 disables the cache) can be changed with these environment variables
+CACHE_DIR = os.environ.get("BEAM_LOG_CACHE_DIR",
+                           os.path.join(os.path.expanduser("~"), ".cache", "cross-section-parsers", "beam_logs"))
+CACHE_MAX_SIZE = int(os.environ.get("BEAM_LOG_CACHE_MAX_SIZE", 4 << 30))
+# Bump it when the parsed arrays change, the entries of the other versions are never used
+CACHE_VERSION = 1
+INDEX_FILE = "index.json"
+HASH_SIZE = 16
+HASH_CHUNK_SIZE = 1 << 20
+
+
+def file_hash(file_path: str) -> str:
+    """
+    Content hash of the log, with the cache version so a new version never maps the arrays of an old one
+    """
+    digest = hashlib.blake2b(str(CACHE_VERSION).encode(), digest_size=HASH_SIZE)
+    with open(file_path, "rb") as fp:
+        for chunk in iter(lambda: fp.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_index(cache_dir: str) -> dict:
+    """
+    :return: dict with the stat of the logs seen ("files", path -> size, mtime_ns and hash) and the cached
+             entries ("entries", hash -> bytes, last use time and log path)
+    """
+    index_path = os.path.join(cache_dir, INDEX_FILE)
+    empty_index = {"version": CACHE_VERSION, "files": dict(), "entries": dict()}
+    if not os.path.isfile(index_path):
+        return empty_index
+    try:
+        with open(index_path) as fp:
+            index = json.load(fp)
+    except (OSError, ValueError):
+        return empty_index
+    if index.get("version") != CACHE_VERSION:
+        return empty_index
+    # An entry removed by hand is no longer cached
+    index["entries"] = {file_key: entry for file_key, entry in index["entries"].items()
+                        if os.path.isdir(os.path.join(cache_dir, file_key))}
+    return index
+
+
+def save_index(cache_dir: str, index: dict):
+    """
+    Replace the index atomically, a run killed while writing it keeps the previous one
+    """
+    with tempfile.NamedTemporaryFile("w", dir=cache_dir, prefix=INDEX_FILE, delete=False) as fp:
+        json.dump(index, fp)
+    os.replace(fp.name, os.path.join(cache_dir, INDEX_FILE))
+
+
+def remove_entry(cache_dir: str, index: dict, file_key: str):
+    shutil.rmtree(os.path.join(cache_dir, file_key), ignore_errors=True)
+    index["entries"].pop(file_key, None)
+    index["files"] = {path: stat for path, stat in index["files"].items() if stat["hash"] != file_key}
+
+
+def evict(cache_dir: str, index: dict, max_size: int):
+    """
+    Remove the least recently used entries until the cache fits in max_size bytes
+    """
+    total_size = sum(entry["bytes"] for entry in index["entries"].values())
+    for file_key, entry in sorted(index["entries"].items(), key=lambda item: item[1]["last_used"]):
+        if total_size <= max_size:
+            break
+        print(f"Removing {entry['path']} from the beam log cache")
+        remove_entry(cache_dir=cache_dir, index=index, file_key=file_key)
+        total_size -= entry["bytes"]
+
+
+def write_entry(cache_dir: str, file_key: str, arrays: dict) -> int:
+    """
+    Save the arrays as <cache_dir>/<file_key>/<name>.npy, the dir appears only once all the arrays are written
+    :return: bytes written
+    """
+    tmp_dir = tempfile.mkdtemp(dir=cache_dir, prefix=f"{file_key}.")
+    try:
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp_dir, f"{name}.npy"), np.ascontiguousarray(array))
+        size = sum(os.path.getsize(os.path.join(tmp_dir, file_name)) for file_name in os.listdir(tmp_dir))
+        try:
+            os.rename(tmp_dir, os.path.join(cache_dir, file_key))
+        except OSError:
+            # Written at the same time by another run
+            shutil.rmtree(tmp_dir)
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    return size
+
+
+def read_entry(cache_dir: str, file_key: str) -> dict:
+    """
+    :return: dict name -> read only array mapped from its .npy
+    """
+    entry_dir = os.path.join(cache_dir, file_key)
+    return {file_name[:-len(".npy")]: np.load(os.path.join(entry_dir, file_name), mmap_mode="r")
+            for file_name in sorted(os.listdir(entry_dir)) if file_name.endswith(".npy")}
+
+
+def cached_arrays(file_path: str, parse: Callable[[str], dict], cache_dir: str = CACHE_DIR,
+                  max_size: int = CACHE_MAX_SIZE) -> dict:
+    """
+    The arrays parsed from file_path, mapped from the cache when the log was already parsed
+    :param file_path: beam log
+    :param parse: function that parses the log into a dict name -> numpy array, called on a cache miss
+    :param cache_dir: dir of the cache, created if missing
+    :param max_size: size cap of the cache in bytes, 0 disables the cache
+    :return: dict name -> numpy array
+    """
+    if max_size <= 0:
+        return parse(file_path)
+    os.makedirs(cache_dir, exist_ok=True)
+    index = load_index(cache_dir=cache_dir)
+    abs_path = os.path.abspath(file_path)
+    stat = os.stat(file_path)
+    file_stat = index["files"].get(abs_path)
+    if file_stat and (file_stat["size"], file_stat["mtime_ns"]) == (stat.st_size, stat.st_mtime_ns):
+        file_key = file_stat["hash"]
+    else:
+        # New or changed log, the hash finds a copy of a log already cached
+        file_key = file_hash(file_path)
+        index["files"][abs_path] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "hash": file_key}
+
+    entry = index["entries"].get(file_key)
+    if entry is not None:
+        print(f"Loading {file_path} from the beam log cache {cache_dir}")
+        arrays = read_entry(cache_dir=cache_dir, file_key=file_key)
+    else:
+        arrays = parse(file_path)
+        entry = {"bytes": write_entry(cache_dir=cache_dir, file_key=file_key, arrays=arrays), "path": abs_path}
+        index["entries"][file_key] = entry
+    entry["last_used"] = time.time()
+    evict(cache_dir=cache_dir, index=index, max_size=max_size)
+    save_index(cache_dir=cache_dir, index=index)
+    return arrays
+
+
+def print_info(cache_dir: str, max_size: int):
+    index = load_index(cache_dir=cache_dir)
+    entries = sorted(index["entries"].items(), key=lambda item: item[1]["last_used"], reverse=True)
+    total_size = sum(entry["bytes"] for _, entry in entries)
+    print(f"{cache_dir}: {len(entries)} logs, {total_size / 1e6:.1f} MB of {max_size / 1e6:.1f} MB")
+    for file_key, entry in entries:
+        print(f"{file_key} {entry['bytes'] / 1e6:>10.1f} MB  {time.ctime(entry['last_used'])}  {entry['path']}")
+
+
+def clear(cache_dir: str):
+    """
+    Remove the entries, the index and what the killed runs left, nothing else of cache_dir
+    """
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        if re.fullmatch(rf"[0-9a-f]{{{2 * HASH_SIZE}}}(\..+)?", name) and os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        elif name.startswith(INDEX_FILE):
+            os.remove(path)
+    print(f"Cleared {cache_dir}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or clear the cache of the beam logs parsed by "
+                                                 "calc_cross_section.py. The cache maps the arrays of a log "
+                                                 "already parsed, found by its path, size and mtime or by its "
+                                                 "content hash, the least recently used logs are removed above "
+                                                 "the size cap")
+    parser.add_argument("command", choices=["info", "clear"],
+                        help="info lists the cached logs, from the most recently used, clear removes them")
+    parser.add_argument("--cache-dir", default=CACHE_DIR,
+                        help=f"Cache dir, BEAM_LOG_CACHE_DIR (default {CACHE_DIR})")
+    args = parser.parse_args()
+    if not os.path.isdir(args.cache_dir):
+        print(f"{args.cache_dir} is empty")
+    elif args.command == "clear":
+        clear(cache_dir=args.cache_dir)
+    else:
+        print_info(cache_dir=args.cache_dir, max_size=CACHE_MAX_SIZE)
+
+
+if __name__ == '__main__':
+    main()
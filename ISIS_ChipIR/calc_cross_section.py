@@ -1,59 +1,276 @@
 #!/usr/bin/env python3
+import csv
+import gc
+import io
+import itertools
 import sys
 from datetime import datetime
+from typing import Iterable, Iterator, NamedTuple, Optional
 
 import numpy as np
 import pandas as pd
 
+import beam_log_cache
+
 # Time for each run
 SECONDS_1h = 3600
+# Fields of a ChipIR count line used by read_count_file, date, time, fraction of second, ..., fission counter
+COUNT_FILE_FIELDS = 7
+# Bytes of each block of --stream, about 200k lines
+COUNT_FILE_CHUNK_SIZE = 16 << 20
+# The neutron counts of a run are read up to 3 seconds after its end
+COUNT_WINDOW_MARGIN = pd.Timedelta(seconds=3)
+
+
+class BeamCounts(NamedTuple):
+    """
+    ChipIR neutron log as parallel contiguous arrays, 16 bytes per sample.
+    Each field is a .npy of the beam log cache, bump beam_log_cache.CACHE_VERSION when they change
+    """
+    # Time of each sample, int64 nanoseconds since the epoch, the log times are naive
+    time_ns: np.ndarray
+    # Fission counter of each sample, float64
+    fission_counter: np.ndarray
+
+
+class WindowCounts(NamedTuple):
+    """
+    What the flux of a run needs from the neutron counts of its window
+    """
+    first_fission_counter: float
+    # None when the window has a single sample
+    last_fission_counter: Optional[float]
+    # Seconds without beam, 0 when the counter always changed
+    beam_off_time: float
+
+
+def to_ns(dt) -> int:
+    """
+    datetime or pd.Timestamp as the int64 nanoseconds of BeamCounts.time_ns
+    """
+    return pd.Timestamp(dt).value
+
+
+def print_malformed_lines(lines: Iterable[str], malformed):
+    """
+    Report the lines ignored by read_count_file
+    :param lines: lines of the neutron log, e.g. the open file
+    :param malformed: iterable with one bool per line
+    """
+    for line, is_malformed in zip(lines, malformed):
+        if is_malformed:
+            print(f"Ignoring line (malformed):{line}")
+
+
+def parse_count_times(year_date: pd.Series, day_time: pd.Series, sec_frac: pd.Series) -> np.ndarray:
+    """
+    Vectorized datetime.strptime(year_date + " " + day_time + sec_frac, "%d/%m/%Y %H:%M:%S.%f")
+    The usual dd/mm/YYYY HH:MM:SS .fff layout is rearranged byte by byte into ISO text, which numpy converts
+    in C, any other layout goes through pd.to_datetime
+    :return: datetime64[us] array
+    """
+    if ((year_date.str.len() == 10).all() and (day_time.str.len() == 8).all() and
+            sec_frac.str.fullmatch(r"\.\d{1,6}").all()):
+        date_bytes = year_date.to_numpy().astype("S10").view(np.uint8).reshape(-1, 10)
+        iso_bytes = np.empty((len(date_bytes), 19), dtype=np.uint8)
+        iso_bytes[:, 0:4] = date_bytes[:, 6:10]
+        iso_bytes[:, 5:7] = date_bytes[:, 3:5]
+        iso_bytes[:, 8:10] = date_bytes[:, 0:2]
+        iso_bytes[:, [4, 7, 10]] = np.frombuffer(b"--T", dtype=np.uint8)
+        iso_bytes[:, 11:19] = day_time.to_numpy().astype("S8").view(np.uint8).reshape(-1, 8)
+        try:
+            seconds = iso_bytes.view("S19").ravel().astype("datetime64[s]")
+            microseconds = np.rint(sec_frac.astype(float).to_numpy() * 1e6).astype("timedelta64[us]")
+            return seconds + microseconds
+        except ValueError:
+            # Not a valid date, pd.to_datetime reports it
+            pass
+    return pd.to_datetime(year_date + " " + day_time + sec_frac,
+                          format="%d/%m/%Y %H:%M:%S.%f").to_numpy().astype("datetime64[us]")
 
 
-def read_count_file(in_file_name: str):
+def parse_count_lines(count_source, report_malformed) -> BeamCounts:
+    """
+    Split the neutron log lines of count_source with pandas and convert the timestamps in a single vectorized call
+    :param count_source: path or buffer of neutron log lines
+    :param report_malformed: called with one bool per line when some lines are malformed
+    :return: BeamCounts with the neutron lines of count_source
+    """
+    # One row per line, also for the blank lines, with the first 7 whitespace separated fields as text.
+    # The missing fields are empty strings, the malformed lines have no 7th field
+    try:
+        count_df = pd.read_csv(count_source, sep=r"\s+", header=None, names=range(COUNT_FILE_FIELDS),
+                               index_col=False, usecols=[0, 1, 2, COUNT_FILE_FIELDS - 1], dtype=str, na_filter=False,
+                               skip_blank_lines=False, quoting=csv.QUOTE_NONE, engine="c")
+    except pd.errors.EmptyDataError:
+        # Nothing but blank lines
+        report_malformed(itertools.repeat(True))
+        return BeamCounts(time_ns=np.empty(0, dtype=np.int64), fission_counter=np.empty(0, dtype=np.float64))
+    except pd.errors.ParserError:
+        # No line has the 7 fields
+        report_malformed(itertools.repeat(True))
+        return BeamCounts(time_ns=np.empty(0, dtype=np.int64), fission_counter=np.empty(0, dtype=np.float64))
+    # Sanity check, we require a date at the beginning of the line
+    malformed = (count_df[COUNT_FILE_FIELDS - 1] == "").to_numpy()
+    if malformed.any():
+        report_malformed(malformed)
+        count_df = count_df[~malformed]
+
+    year_date, day_time, sec_frac = count_df[0], count_df[1], count_df[2]
+    # Generate datetime for all the lines
+    cur_dt = parse_count_times(year_date=year_date, day_time=day_time, sec_frac=sec_frac)
+    return BeamCounts(time_ns=np.ascontiguousarray(cur_dt.astype("datetime64[ns]").view(np.int64)),
+                      fission_counter=np.ascontiguousarray(count_df[6].to_numpy(dtype=np.float64)))
+
+
+def read_count_file(in_file_name: str) -> BeamCounts:
     """
     Read neutron log file
     :param in_file_name: neutron log filename
-    :return: numpy array with all neutron lines
-    """
-    file_lines = list()
-    with open(in_file_name, 'r') as in_file:
-        for line in in_file:
-            # Sanity check, we require a date at the beginning of the line
-            line_split = line.rstrip().split()
-            if len(line_split) < 7:
-                print(f"Ignoring line (malformed):{line}")
+    :return: BeamCounts with all neutron lines
+    """
+    def report_malformed(malformed):
+        with open(in_file_name, 'r') as in_file:
+            print_malformed_lines(lines=in_file, malformed=malformed)
+
+    return parse_count_lines(count_source=in_file_name, report_malformed=report_malformed)
+
+
+def iter_count_file_chunks(in_file_name: str, chunk_size: int = COUNT_FILE_CHUNK_SIZE) -> Iterator[BeamCounts]:
+    """
+    Read neutron log file in blocks of whole lines, only one block is in memory at a time
+    :param in_file_name: neutron log filename
+    :param chunk_size: bytes of each block, the block is completed up to the end of its last line
+    :return: iterator of the time ordered, non empty BeamCounts blocks
+    """
+    last_time_ns = None
+    # Read as bytes, a StringIO of the text would take 4 bytes per character
+    with open(in_file_name, 'rb') as in_file:
+        for chunk in iter(lambda: in_file.read(chunk_size) + in_file.readline(), b""):
+            block = parse_count_lines(
+                count_source=io.BytesIO(chunk),
+                report_malformed=lambda malformed: print_malformed_lines(lines=io.TextIOWrapper(io.BytesIO(chunk)),
+                                                                         malformed=malformed))
+            if block.time_ns.size == 0:
                 continue
-            year_date, day_time, sec_frac = line_split[0], line_split[1], line_split[2]
-            fission_counter = float(line_split[6])
+            # The flux engine goes forward only
+            if (last_time_ns is not None and block.time_ns[0] < last_time_ns) or np.any(np.diff(block.time_ns) < 0):
+                raise ValueError(f"{in_file_name} is not in time order, merge it with merge_neutrons_count_files.py")
+            last_time_ns = block.time_ns[-1]
+            # The .str accessors of the parsed columns are reference cycles, they would keep every block's text
+            # columns until the next automatic collection
+            gc.collect()
+            yield block
+
 
-            # Generate datetime for line
-            cur_dt = datetime.strptime(year_date + " " + day_time + sec_frac, "%d/%m/%Y %H:%M:%S.%f")
-            # It is faster to modify the lines on source
-            file_lines.append(np.array([cur_dt, fission_counter]))
-    return np.array(file_lines)
+def load_count_file(in_file_name: str) -> BeamCounts:
+    """
+    read_count_file through the beam log cache, a log already parsed is mapped from the cache.
+    The malformed lines are only reported when the log is parsed
+    """
+    return BeamCounts(**beam_log_cache.cached_arrays(file_path=in_file_name,
+                                                     parse=lambda path: read_count_file(path)._asdict()))
 
 
-def get_fluency_flux(start_dt: datetime, end_dt, neutron_count: np.array, facility_factor: float,
-                     distance_attenuation: float):
+def count_window(start_dt: datetime, end_dt, neutron_count: BeamCounts) -> WindowCounts:
     """
     -- Fission counters are the ChipIR counters -- index 6 in the ChipIR log
     -- Current Integral are the synchrotron output -- index 7 in the ChipIR log
     """
-    three_seconds = pd.Timedelta(seconds=3)
     # Slicing the neutron count to use only the useful information
-    # It is efficient because it returns a view of neutron count
-    neutron_count_cut = neutron_count[(neutron_count[:, 0] >= start_dt) &
-                                      (neutron_count[:, 0] <= (end_dt + three_seconds))]
-    beam_off_time, last_fission_counter = 0, None
+    in_interval = ((neutron_count.time_ns >= to_ns(start_dt)) &
+                   (neutron_count.time_ns <= to_ns(end_dt + COUNT_WINDOW_MARGIN)))
+    time_ns = neutron_count.time_ns[in_interval]
+    fission_counters = neutron_count.fission_counter[in_interval]
     # Get the first from the list
-    last_dt, first_fission_counter = neutron_count_cut[0]
-    # Loop thought the neutron to find the beam off
-    for (cur_dt, fission_counter) in neutron_count_cut[1:]:
-        if fission_counter == last_fission_counter:
-            beam_off_time += (cur_dt - last_dt).total_seconds()
-        last_fission_counter = fission_counter
-        last_dt = cur_dt
+    first_fission_counter = float(fission_counters[0])
+    last_fission_counter = float(fission_counters[-1]) if len(fission_counters) > 1 else None
+    # The beam is off while the counter does not change. The step from the first sample is not checked, as in
+    # the former loop. The steps are added in order, in seconds with microsecond resolution, as timedelta did
+    beam_off = fission_counters[2:] == fission_counters[1:-1]
+    beam_off_seconds = (np.diff(time_ns)[1:][beam_off] // 1000) / 1e6
+    beam_off_time = float(np.add.accumulate(beam_off_seconds)[-1]) if beam_off_seconds.size else 0
+    return WindowCounts(first_fission_counter=first_fission_counter, last_fission_counter=last_fission_counter,
+                        beam_off_time=beam_off_time)
+
+
+class StreamWindow:
+    """
+    WindowCounts of one run built block by block, with the same steps as count_window
+    """
+
+    def __init__(self, start_ns: int, end_ns: int):
+        self.start_ns = start_ns
+        self.end_ns = end_ns
+        self.samples = 0
+        self.first_fission_counter = None
+        self.last_time_ns = None
+        self.last_fission_counter = None
+        self.beam_off_time = 0
 
+    def add(self, block: BeamCounts):
+        """
+        Add the samples of the next time ordered block that fall in the window
+        """
+        begin = np.searchsorted(block.time_ns, self.start_ns, side="left")
+        end = np.searchsorted(block.time_ns, self.end_ns, side="right")
+        if begin == end:
+            return
+        time_ns = block.time_ns[begin:end]
+        fission_counters = block.fission_counter[begin:end]
+        if self.samples == 0:
+            self.first_fission_counter = float(fission_counters[0])
+            # The step from the first sample is not checked
+            skip_steps = 1
+        else:
+            # The step from the last sample of the previous blocks
+            time_ns = np.concatenate([[self.last_time_ns], time_ns])
+            fission_counters = np.concatenate([[self.last_fission_counter], fission_counters])
+            skip_steps = 1 if self.samples == 1 else 0
+        beam_off = fission_counters[skip_steps + 1:] == fission_counters[skip_steps:-1]
+        beam_off_seconds = (np.diff(time_ns)[skip_steps:][beam_off] // 1000) / 1e6
+        if beam_off_seconds.size:
+            # Continue the sum in order from the previous blocks
+            self.beam_off_time = float(np.add.accumulate(np.concatenate([[self.beam_off_time], beam_off_seconds]))[-1])
+        self.samples += end - begin
+        self.last_time_ns = int(time_ns[-1])
+        self.last_fission_counter = float(fission_counters[-1])
+
+    def counts(self) -> WindowCounts:
+        if self.samples == 0:
+            raise ValueError(f"No neutron count between {pd.Timestamp(self.start_ns)} and {pd.Timestamp(self.end_ns)}")
+        return WindowCounts(first_fission_counter=self.first_fission_counter,
+                            last_fission_counter=self.last_fission_counter if self.samples > 1 else None,
+                            beam_off_time=self.beam_off_time)
+
+
+def stream_windows(blocks: Iterable[BeamCounts], start_ns: np.ndarray, end_ns: np.ndarray) -> list:
+    """
+    count_window of many runs in one forward pass over the neutron log, the memory is bounded by one block
+    :param blocks: time ordered BeamCounts blocks, e.g. iter_count_file_chunks
+    :param start_ns: start of each window, int64 nanoseconds
+    :param end_ns: end of each window, included
+    :return: list with the WindowCounts of each window, in the order of start_ns
+    """
+    windows = [StreamWindow(start_ns=int(start), end_ns=int(end)) for start, end in zip(start_ns, end_ns)]
+    # The windows are opened in time order and closed once the log went past their end
+    pending = iter(sorted(windows, key=lambda window: window.start_ns))
+    next_window = next(pending, None)
+    open_windows = list()
+    for block in blocks:
+        block_end_ns = block.time_ns[-1]
+        while next_window is not None and next_window.start_ns <= block_end_ns:
+            open_windows.append(next_window)
+            next_window = next(pending, None)
+        for window in open_windows:
+            window.add(block=block)
+        open_windows = [window for window in open_windows if window.end_ns >= block_end_ns]
+    return [window.counts() for window in windows]
+
+
+def window_flux(start_dt: datetime, end_dt, window_counts: WindowCounts, facility_factor: float,
+                distance_attenuation: float):
+    first_fission_counter, last_fission_counter, beam_off_time = window_counts
     interval_total_seconds = float((end_dt - start_dt).total_seconds())
     flux = ((last_fission_counter - first_fission_counter) * facility_factor) / interval_total_seconds
     error_str = f"FLUX<0 {start_dt} {end_dt} {flux} {last_fission_counter} {interval_total_seconds} {beam_off_time}"
@@ -63,7 +280,18 @@ def get_fluency_flux(start_dt: datetime, end_dt, neutron_count: np.array, facili
     return flux, beam_off_time
 
 
-def generate_cross_section(row: pd.Series, distance_data: dict, neutron_count: np.array):
+def get_fluency_flux(start_dt: datetime, end_dt, neutron_count: BeamCounts, facility_factor: float,
+                     distance_attenuation: float):
+    return window_flux(start_dt=start_dt, end_dt=end_dt,
+                       window_counts=count_window(start_dt=start_dt, end_dt=end_dt, neutron_count=neutron_count),
+                       facility_factor=facility_factor, distance_attenuation=distance_attenuation)
+
+
+def generate_cross_section(row: pd.Series, distance_data: dict, neutron_count: Optional[BeamCounts],
+                           run_windows: Optional[dict] = None):
+    """
+    :param run_windows: WindowCounts of each run index from stream_windows, used instead of neutron_count
+    """
     start_dt = row["start_dt"]
     end_dt = row["end_dt"]
     machine = row["machine"]
@@ -81,8 +309,13 @@ def generate_cross_section(row: pd.Series, distance_data: dict, neutron_count: n
     distance_attenuation = float(distance_line["Distance attenuation"])
 
     print(f"Generating cross section for {row['benchmark']}, start {start_dt} end {end_dt}")
-    flux, time_beam_off = get_fluency_flux(start_dt=start_dt, end_dt=end_dt, neutron_count=neutron_count,
-                                           facility_factor=facility_factor, distance_attenuation=distance_attenuation)
+    if run_windows is None:
+        flux, time_beam_off = get_fluency_flux(start_dt=start_dt, end_dt=end_dt, neutron_count=neutron_count,
+                                               facility_factor=facility_factor,
+                                               distance_attenuation=distance_attenuation)
+    else:
+        flux, time_beam_off = window_flux(start_dt=start_dt, end_dt=end_dt, window_counts=run_windows[row.name],
+                                          facility_factor=facility_factor, distance_attenuation=distance_attenuation)
     fluency = flux * acc_time
     cross_section_sdc = cross_section_app = cross_section_sys = 0
     if fluency > 0:
@@ -115,13 +348,16 @@ def get_end_times(group):
 
 
 def main():
-    if len(sys.argv) < 3:
-        print(f"Usage: {sys.argv[0]} <neutron counts input file> <csv file> <distance facility_factor file>")
+    if len(sys.argv) < 4 or sys.argv[4:] not in [[], ["--stream"]]:
+        print(f"Usage: {sys.argv[0]} <neutron counts input file> <csv file> <distance facility_factor file> "
+              f"[--stream]")
+        print("--stream reads the time ordered neutron counts in blocks, for logs bigger than the memory")
         exit(1)
 
     neutron_count_file = sys.argv[1]
     csv_file_name = sys.argv[2]
     distance_factor_file = sys.argv[3]
+    stream = sys.argv[4:] == ["--stream"]
     print(f"Generating cross section for {csv_file_name}")
     print(f"- {distance_factor_file} for distance")
     print(f"- {neutron_count_file} for neutrons")
@@ -137,12 +373,25 @@ def main():
     )
     # -----------------------------------------------------------------------------------------------------------------
     # We need to read the neutron count files before calling get_fluency_flux
-    neutron_count = read_count_file(neutron_count_file)
+    neutron_count = None if stream else load_count_file(neutron_count_file)
 
-    csv_out_file_summary = csv_file_name.replace(".csv", "_cross_section.csv")
     # -----------------------------------------------------------------------------------------------------------------
-    # Read the input csv file
-    input_df = pd.read_csv(csv_file_name, delimiter=';').drop("file_path", axis="columns")
+    # Read the input csv file, or the typed parquet file written by first_parser_sdc-csv-generator.py --format parquet
+    if csv_file_name.endswith(".parquet"):
+        csv_out_file_summary = csv_file_name.replace(".parquet", "_cross_section.csv")
+        input_df = pd.read_parquet(csv_file_name).drop("file_path", axis="columns")
+    else:
+        csv_out_file_summary = csv_file_name.replace(".csv", "_cross_section.csv")
+        input_df = pd.read_csv(csv_file_name, delimiter=';').drop("file_path", axis="columns")
+
+    # Group on the integer header_id written by first_parser_sdc-csv-generator.py, older CSVs get one here.
+    # The runs without header were dropped by the grouping on the header text
+    input_df = input_df.dropna(subset=["header"])
+    if "header_id" not in input_df:
+        input_df["header_id"] = pd.factorize(input_df["header"], sort=True)[0]
+    input_df["header_id"] = input_df["header_id"].astype("int64")
+    # The typed header_<key> columns are kept for the filters on the output
+    header_key_columns = [column for column in input_df if column.startswith("header_") and column != "header_id"]
 
     # Before continue we need to invert the logic of app crash and end
     input_df["#DUE"] = input_df.apply(lambda r: 1 if r["#appcrash"] != 0 or r["#syscrash"] != 0 else 0, axis="columns")
@@ -173,19 +422,30 @@ def main():
     ####################################################################################################################
     # TO USE only 1h ACC TIME and bigger acc times will be placed in chunks
     runs = input_df.copy()
-    runs['end_dt'] = runs.groupby(['machine', 'benchmark', 'header'])['start_dt'].transform(get_end_times)
-    runs = runs.groupby(['machine', 'benchmark', 'header', 'end_dt']).agg({'start_dt': 'first', '#SDC': 'sum',
-                                                                           '#appcrash': 'sum', '#syscrash': 'sum',
-                                                                           '#end': 'sum', '#abort': 'sum',
-                                                                           'acc_time': 'sum', 'acc_err': 'sum',
-                                                                           '#DUE': 'sum'
-                                                                           }).reset_index()
+    # observed=True, the parquet machine/benchmark columns are categorical
+    runs['end_dt'] = runs.groupby(['machine', 'benchmark', 'header_id'], observed=True)['start_dt'].transform(
+        get_end_times)
+    runs = runs.groupby(['machine', 'benchmark', 'header_id', 'end_dt'], observed=True).agg(
+        {'header': 'first', 'start_dt': 'first', '#SDC': 'sum', '#appcrash': 'sum', '#syscrash': 'sum', '#end': 'sum',
+         '#abort': 'sum', 'acc_time': 'sum', 'acc_err': 'sum', '#DUE': 'sum',
+         **{column: 'first' for column in header_key_columns}}).reset_index()
+    # Same columns as the grouping on the header text, plus the header id
+    runs.insert(2, 'header', runs.pop('header'))
     runs["original_acc_time"] = runs["acc_time"]
     runs.loc[runs["acc_time"] > SECONDS_1h, "acc_time"] = SECONDS_1h
     ####################################################################################################################
 
+    run_windows = None
+    if stream:
+        print(f"Reading {neutron_count_file} in blocks of {COUNT_FILE_CHUNK_SIZE >> 20} MB")
+        window_counts = stream_windows(
+            blocks=iter_count_file_chunks(neutron_count_file),
+            start_ns=runs["start_dt"].to_numpy(dtype="datetime64[ns]").view(np.int64),
+            end_ns=(runs["end_dt"] + COUNT_WINDOW_MARGIN).to_numpy(dtype="datetime64[ns]").view(np.int64))
+        run_windows = dict(zip(runs.index, window_counts))
+
     # Apply generate_cross section function
-    final_df = runs.apply(generate_cross_section, axis="columns", args=(distance_data, neutron_count))
+    final_df = runs.apply(generate_cross_section, axis="columns", args=(distance_data, neutron_count, run_windows))
     print(f"in: {csv_file_name}")
     print(f"out: {csv_out_file_summary}")
     final_df.to_csv(csv_out_file_summary, index=False, date_format="%Y-%m-%d %H:%M:%S")
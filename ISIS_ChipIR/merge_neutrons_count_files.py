@@ -1,22 +1,123 @@
 #!/usr/bin/env python3
+import heapq
+import re
 import sys
+from datetime import datetime, timedelta
+from typing import Iterator, Optional, Tuple
 
 # Default line in the logs
 DEFAULT_CHIPIR_LINE_SIZE = 80
+# Samples further apart than this are reported as a gap of the merged log
+MAX_SAMPLE_GAP = timedelta(minutes=1)
+FRACTION_OF_SECOND_RE = re.compile(r"\.\d{1,6}", re.ASCII)
+
+
+def parse_line_time(line: str) -> Optional[datetime]:
+    """
+    Time of a ChipIR count line, date, time, fraction of second, ...
+    :return: the datetime, or None when the line does not start with a valid time
+    """
+    fields = line.split(maxsplit=3)
+    if len(fields) < 3:
+        return None
+    year_date, day_time, sec_frac = fields[:3]
+    # The usual dd/mm/YYYY HH:MM:SS .fff layout is rearranged into ISO text, which datetime converts in C
+    if len(year_date) == 10 and len(day_time) == 8 and FRACTION_OF_SECOND_RE.fullmatch(sec_frac):
+        try:
+            return datetime.fromisoformat(f"{year_date[6:10]}-{year_date[3:5]}-{year_date[0:2]}T{day_time}{sec_frac}")
+        except ValueError:
+            pass
+    try:
+        return datetime.strptime(year_date + " " + day_time + sec_frac, "%d/%m/%Y %H:%M:%S.%f")
+    except ValueError:
+        return None
+
+
+def read_samples(path: str, report: bool = True) -> Iterator[Tuple[datetime, str]]:
+    """
+    Read one count file line by line
+    :param path: ChipIR count file
+    :param report: print the lines that are dropped
+    :return: iterator of (time, line) of the valid lines, in time order. The lines that go back in time are dropped
+    """
+    last_time = None
+    with open(path, 'r') as input_file:
+        for line in input_file:
+            line_time = parse_line_time(line) if len(line) >= DEFAULT_CHIPIR_LINE_SIZE else None
+            if line_time is None:
+                if report:
+                    print(f"Line not parsed {line} at file {path}")
+            elif last_time is not None and line_time < last_time:
+                if report:
+                    print(f"Line out of time order {line} at file {path}, after {last_time}")
+            else:
+                last_time = line_time
+                yield line_time, line
 
 
 def merge_files():
-    output_file = sys.argv[1]
-    paths = sys.argv[2:]
-    paths.sort()
-    with open(output_file, "w") as output_file:
-        for path in paths:
-            with open(path, 'r') as input_file:
-                for line in input_file:
-                    if len(line) >= DEFAULT_CHIPIR_LINE_SIZE:
-                        output_file.write(line)
-                    else:
-                        print(f"Line not parsed {line} at file {path}")
+    """
+    k-way merge of the count files on the time of their samples.
+    A file is opened only when the merge reaches its first sample, so only the overlapping files are open at once
+    and the memory does not depend on the number of files
+    """
+    if len(sys.argv) < 3:
+        print(f"Usage: {sys.argv[0]} <output file> <count files...>")
+        exit(1)
+    output_path = sys.argv[1]
+    paths = sorted(sys.argv[2:])
+
+    # Files in the order of their first sample
+    first_samples = list()
+    for path in paths:
+        first_sample = next(read_samples(path=path, report=False), None)
+        if first_sample is None:
+            # Report its lines
+            for _ in read_samples(path=path):
+                pass
+            print(f"No sample at file {path}")
+        else:
+            first_samples.append((first_sample[0], path))
+    first_samples.sort()
+    next_file = 0
+
+    # (time, file index, line, samples of the file), only one item of each open file
+    heap = list()
+    last_time = last_line = None
+    merged = duplicates = 0
+    with open(output_path, "w") as output_file:
+        while heap or next_file < len(first_samples):
+            # Open the files that start before the next sample
+            while next_file < len(first_samples) and (not heap or first_samples[next_file][0] <= heap[0][0]):
+                first_time, path = first_samples[next_file]
+                if heap:
+                    overlapped = ", ".join(first_samples[item[1]][1] for item in heap)
+                    print(f"Overlap: {path} starts at {first_time}, before the end of {overlapped}")
+                samples = read_samples(path=path)
+                line_time, line = next(samples)
+                heapq.heappush(heap, (line_time, next_file, line, samples))
+                next_file += 1
+
+            line_time, file_index, line, samples = heap[0]
+            next_sample = next(samples, None)
+            if next_sample is None:
+                heapq.heappop(heap)
+            else:
+                heapq.heapreplace(heap, (next_sample[0], file_index, next_sample[1], samples))
+
+            if line_time == last_time:
+                # The same sample in two overlapping files
+                duplicates += 1
+                if line.split() != last_line.split():
+                    print(f"Duplicate sample {line} at file {first_samples[file_index][1]} differs from {last_line}")
+                continue
+            if last_time is not None and line_time - last_time > MAX_SAMPLE_GAP:
+                print(f"Gap: no sample from {last_time} to {line_time} ({line_time - last_time})")
+            output_file.write(line if line.endswith("\n") else line + "\n")
+            last_time, last_line = line_time, line
+            merged += 1
+    print(f"Merged {merged} samples of {len(first_samples)} files into {output_path}, "
+          f"{duplicates} duplicate samples dropped")
 
 
 if __name__ == '__main__':
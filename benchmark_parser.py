@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import os
+import re
+import shlex
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import generate_loghelper_logs
+
+PARSER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "first_parser_sdc-csv-generator.py")
+TOTAL_SDC_RE = re.compile(r"TOTAL_SDC: (\d+)")
+
+
+def run_parser(parser_script: str, parser_args: list, data_dir: str, work_dir: str) -> dict:
+    """
+    Run the parser once on data_dir, as a new process
+    :param parser_script: path of first_parser_sdc-csv-generator.py
+    :param parser_args: extra arguments of the parser, e.g. ["-j", "4"]
+    :param data_dir: dir with the logs, the parser runs from it
+    :param work_dir: dir for the output of the parser and its --stats-json
+    :return: the --stats-json report of the run, with the TOTAL_SDC the parser printed and the wall time of the process
+    """
+    stats_file = os.path.join(work_dir, "stats.json")
+    output_dir = os.path.join(work_dir, "logs_parsed")
+    command = [sys.executable, parser_script, *parser_args, "--output-dir", output_dir, "--stats-json", stats_file]
+    start = time.perf_counter()
+    result = subprocess.run(command, cwd=data_dir, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    process_wall = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(f"{shlex.join(command)} failed:\n{result.stdout}")
+    total_sdc_m = TOTAL_SDC_RE.search(result.stdout)
+    with open(stats_file) as fp:
+        stats = json.load(fp)
+    stats["total_sdc"] = int(total_sdc_m.group(1)) if total_sdc_m else None
+    # End to end, with the interpreter start up and the imports
+    stats["process_wall"] = process_wall
+    return stats
+
+
+def median_times(runs: list) -> dict:
+    """
+    Median of the wall and CPU time of each stage, of the whole run and of the parser process, over the repeated runs
+    """
+    stage_names = list(dict.fromkeys(name for run in runs for name in run["stages"]))
+    medians = {"total": {time_type: statistics.median(run["total"][time_type] for run in runs)
+                         for time_type in ["wall", "cpu"]},
+               "process": {"wall": statistics.median(run["process_wall"] for run in runs)}}
+    for name in stage_names:
+        medians[name] = {time_type: statistics.median(run["stages"].get(name, {time_type: 0.0})[time_type]
+                                                      for run in runs)
+                         for time_type in ["wall", "cpu"]}
+    return medians
+
+
+def benchmark_case(args, parser_args: list, files: int, tmp_dir: str) -> dict:
+    """
+    Generate one data set and time args.repeat runs of the parser on it
+    :return: dict with the data set, the median times and all the runs
+    """
+    with tempfile.TemporaryDirectory(prefix="parser_benchmark_", dir=tmp_dir) as bench_dir:
+        data_dir = os.path.join(bench_dir, "data")
+        totals = generate_loghelper_logs.generate_logs(
+            output_dir=data_dir, files=files, log_size=args.log_size, sdc_rate=args.sdc_rate,
+            abort_rate=args.abort_rate, due_rate=args.due_rate, end_rate=args.end_rate,
+            benchmarks=generate_loghelper_logs.DEFAULT_BENCHMARKS, machines=generate_loghelper_logs.DEFAULT_MACHINES,
+            start_dt=datetime(2021, 5, 3, 10, 0, 0), archive=args.archive, logs_per_archive=args.logs_per_archive,
+            seed=args.seed)
+        runs = list()
+        for repeat in range(args.repeat):
+            work_dir = os.path.join(bench_dir, f"run_{repeat}")
+            os.mkdir(work_dir)
+            stats = run_parser(parser_script=args.parser, parser_args=parser_args, data_dir=data_dir,
+                               work_dir=work_dir)
+            if stats["total_sdc"] != totals["#SDC"]:
+                raise RuntimeError(f"The parser found {stats['total_sdc']} SDCs in {files} logs, "
+                                   f"the generator wrote {totals['#SDC']}")
+            runs.append(stats)
+    return {"files": files, "log_size": args.log_size, "archive": args.archive, "bytes": totals["bytes"],
+            "lines": runs[0]["lines"], "total_sdc": totals["#SDC"], "median": median_times(runs), "runs": runs}
+
+
+def print_results(results: list):
+    """
+    Print one row per data set with the median wall time of each stage
+    """
+    stage_names = list(dict.fromkeys(name for result in results for name in result["median"]
+                                     if name not in ["total", "process"]))
+    print(f"\n{'files':>8}{'MB':>10}{'archive':>10}" + "".join(f"{name:>10}" for name in stage_names) +
+          f"{'total':>10}{'process':>10}{'MB/s':>10}{'lines/s':>12}")
+    for result in results:
+        median = result["median"]
+        total_wall = max(median["total"]["wall"], 1e-9)
+        print(f"{result['files']:>8}{result['bytes'] / 1e6:>10.1f}{result['archive'] or '-':>10}" +
+              "".join(f"{median.get(name, {'wall': 0.0})['wall']:>10.3f}" for name in stage_names) +
+              f"{total_wall:>10.3f}{median['process']['wall']:>10.3f}{result['bytes'] / 1e6 / total_wall:>10.1f}"
+              f"{result['lines'] / total_wall:>12.0f}")
+
+
+def compare_baseline(results: list, baseline_file: str, tolerance: float) -> bool:
+    """
+    Compare the median total wall time of each data set with the same data set of a previous --json
+    :return: True if no data set is slower than the baseline by more than tolerance
+    """
+    with open(baseline_file) as fp:
+        baseline = json.load(fp)
+    baseline_results = {(result["files"], result["log_size"], result["archive"]): result
+                        for result in baseline["results"]}
+    no_regression = True
+    print(f"\nCompared with {baseline_file}:")
+    for result in results:
+        baseline_result = baseline_results.get((result["files"], result["log_size"], result["archive"]))
+        if baseline_result is None:
+            print(f"{result['files']:>8} files: not in the baseline")
+            continue
+        wall = result["median"]["total"]["wall"]
+        baseline_wall = baseline_result["median"]["total"]["wall"]
+        change = wall / max(baseline_wall, 1e-9) - 1
+        regression = change > tolerance
+        no_regression &= not regression
+        print(f"{result['files']:>8} files: {baseline_wall:.3f} s -> {wall:.3f} s ({change:+.1%})"
+              f"{'  REGRESSION' if regression else ''}")
+    return no_regression
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time first_parser_sdc-csv-generator.py end to end and per stage "
+                                                 "on synthetic LogHelper logs of several sizes")
+    parser.add_argument("--files", type=int, nargs="+", default=[100, 1000],
+                        help="Number of logs of each data set (default 100 1000)")
+    parser.add_argument("--log-size", type=int, default=64 << 10,
+                        help="Approximate size of each log in bytes (default 65536)")
+    parser.add_argument("--archive", choices=generate_loghelper_logs.ARCHIVE_TYPES,
+                        help="Compress the logs of the data sets instead of writing them loose")
+    parser.add_argument("--logs-per-archive", type=int, default=50,
+                        help="Number of logs in each tar/zip archive (default 50)")
+    parser.add_argument("--sdc-rate", type=float, default=0.01, help="Probability of an SDC at each iteration")
+    parser.add_argument("--abort-rate", type=float, default=0.05, help="Probability of a log ending with an ABORT")
+    parser.add_argument("--due-rate", type=float, default=0.05,
+                        help="Probability of a soft APP reboot or power cycle after a log")
+    parser.add_argument("--end-rate", type=float, default=0.9, help="Probability of a log ending with an END")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the generator (default 0)")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Runs of the parser on each data set, the median is reported (default 3)")
+    parser.add_argument("--parser", default=PARSER_SCRIPT,
+                        help="Parser script to time, e.g. the one of another checkout (default the one next to this "
+                             "script)")
+    parser.add_argument("--parser-args", default="",
+                        help="Extra arguments of the parser, e.g. --parser-args='-j 4 --mmap'")
+    parser.add_argument("--tmp-dir", default=None, help="Where the data sets are generated (default the system tmp)")
+    parser.add_argument("--json", metavar="FILE", help="Write all the results as JSON to FILE")
+    parser.add_argument("--baseline", metavar="FILE",
+                        help="--json of a previous benchmark, exits with 1 if a data set got slower than --tolerance")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Allowed slowdown over --baseline, 0.2 is 20%% (default 0.2)")
+    args = parser.parse_args()
+    if args.repeat < 1 or min(args.files) < 1:
+        parser.error("--repeat and --files must be positive")
+    parser_args = shlex.split(args.parser_args)
+
+    results = list()
+    for files in args.files:
+        print(f"Timing {args.repeat} runs on {files} logs of {args.log_size} bytes")
+        results.append(benchmark_case(args=args, parser_args=parser_args, files=files, tmp_dir=args.tmp_dir))
+    print_results(results=results)
+
+    if args.json:
+        with open(args.json, "w") as fp:
+            json.dump({"parser": args.parser, "parser_args": parser_args, "repeat": args.repeat,
+                       "results": results}, fp, indent=2)
+    if args.baseline and not compare_baseline(results=results, baseline_file=args.baseline,
+                                              tolerance=args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
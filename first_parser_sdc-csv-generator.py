@@ -1,118 +1,1939 @@
 #!/usr/bin/env python3
+import argparse
+import collections
+import concurrent.futures
+import contextlib
 import csv
-import glob
+import fnmatch
+import gzip
+import hashlib
+import importlib.util
+import io
+import itertools
+import json
+import locale
+import lzma
+import mmap
+import multiprocessing
 import os
+import queue
 import re
-from datetime import datetime
+import shutil
+import sqlite3
+import tarfile
+import tempfile
+import threading
+import time
+import zipfile
+import zlib
+from datetime import datetime, timedelta
+from typing import Any, Callable, NamedTuple
+
+# LogHelper file name: YYYY_MM_DD_HH_MM_SS_<benchmark>_<machine>.log
+LOG_NAME_PATTERN = r'(\d+)_(\d+)_(\d+)_(\d+)_(\d+)_(\d+)_(.*)_(.*).log'
+# Format of the time column, it is written with datetime.ctime()
+CTIME_FORMAT = "%a %b %d %H:%M:%S %Y"
+
+# Default output folder and parent dir of the private extraction dir of each run
+OUTPUT_DIR = "logs_parsed"
+TMP_DIR = "/tmp"
+SHM_DIR = "/dev/shm"
+# The extraction dirs are named <prefix><pid>_<random>
+WORKSPACE_PREFIX = "parserSDC_"
+
+# Table of the --sqlite database, and rows upserted in each transaction
+SQLITE_TABLE = "runs"
+SQLITE_HEADERS_TABLE = "headers"
+SQLITE_BATCH_SIZE = 10000
+
+# key:value (or key=value) parameters of the #HEADER, e.g. " size:1024 streams:4 -precision:double" or
+# " size:1024;streams:4", split on the raw header text
+HEADER_PAIR_RE = re.compile(r"([A-Za-z_][\w.]*)[:=][ \t]*([^\s,;]+)")
+# Interned id of the header and prefix of the typed column of each header parameter
+HEADER_ID_COLUMN = "header_id"
+HEADER_COLUMN_PREFIX = "header_"
+
+# Number of slowest logs listed by --stats
+STATS_SLOWEST_LOGS = 10
+
+# Batching of the loose logs for the worker pool
+MAX_LOGS_PER_TASK = 512
+TASKS_PER_JOB = 4
+
+# --pipeline, threads reading the logs ahead of the scanner, logs waiting in the queue and largest log kept in
+# memory, the bigger loose logs are read in place by the scanner and the bigger archive members are spooled to disk
+PIPELINE_READ_THREADS = 4
+PIPELINE_QUEUE_SIZE = 64
+PIPELINE_MAX_BUFFERED = 16 << 20
+
+# Manifest of the incremental runs, kept in the output folder
+MANIFEST_FILE = "manifest.json"
+MANIFEST_VERSION = 2
+HASH_SIZE = 16
+HASH_CHUNK_SIZE = 1 << 20
+
+# Iteration and timestamp of the lines, used by the events
+ITERATION_RE = re.compile(r"Ite:(\d+)")
+LINE_TIME_RE = re.compile(r"Y:(\d+) M:(\d+) D:(\d+) Time:(\d+):(\d+):(\d+)")
+
+# Line terminators of the text mode, used by the mmap scanner
+BYTES_NEWLINE_RE = re.compile(rb"[\r\n]")
+
+# Write buffer of each per machine CSV
+CSV_BUFFER_SIZE = 1 << 20
+
+# Watch mode, seconds between the polls, the largest read of appended data and the running totals printed
+WATCH_INTERVAL = 10.0
+WATCH_READ_SIZE = 16 << 20
+WATCH_TOTALS = ["logs", "#SDC", "#appcrash", "#syscrash", "#abort", "acc_time"]
+
+
+def log_name_fields(log_path: str):
+    """
+    Same as parse_log_name, with the start time as a datetime
+    :return: (start datetime, benchmark, machine_name) or None if the name is not a LogHelper one
+    """
+    log_m = re.match(LOG_NAME_PATTERN, os.path.basename(log_path))
+    if log_m is None:
+        return None
+    year, month, day, hour, minute, sec = [int(log_m.group(i)) for i in range(1, 7)]
+    return datetime(year, month, day, hour, minute, sec), log_m.group(7), log_m.group(8)
+
+
+def parse_log_name(log_path: str):
+    """
+    Extract the start time, benchmark and machine from a LogHelper log name
+    :param log_path: path of the log, only the basename is used
+    :return: (start_dt, benchmark, machine_name) or None if the name is not a LogHelper one
+    """
+    name_fields = log_name_fields(log_path)
+    if name_fields is None:
+        return None
+    start_dt, benchmark, machine_name = name_fields
+    return start_dt.ctime(), benchmark, machine_name
+
+
+class LogFilter(NamedTuple):
+    """
+    Selection of the logs by their name, checked before a log is opened or an archive member is read.
+    The benchmark and machine lists are fnmatch patterns, an empty include list selects everything
+    """
+    since: datetime = None
+    until: datetime = None
+    benchmarks: tuple = ()
+    exclude_benchmarks: tuple = ()
+    machines: tuple = ()
+    exclude_machines: tuple = ()
+
+    def accepts(self, log_path: str) -> bool:
+        """
+        :param log_path: path of the log, only the basename is used
+        :return: True if the name is a LogHelper one started in [since, until) with a selected benchmark and machine
+        """
+        name_fields = log_name_fields(log_path)
+        if name_fields is None:
+            return False
+        start_dt, benchmark, machine_name = name_fields
+        if (self.since and start_dt < self.since) or (self.until and start_dt >= self.until):
+            return False
+        for name, include, exclude in ((benchmark, self.benchmarks, self.exclude_benchmarks),
+                                       (machine_name, self.machines, self.exclude_machines)):
+            if include and not any(fnmatch.fnmatchcase(name, pattern) for pattern in include):
+                return False
+            if any(fnmatch.fnmatchcase(name, pattern) for pattern in exclude):
+                return False
+        return True
+
+
+class LogMarker(NamedTuple):
+    """
+    One marker searched in the LogHelper lines
+    kind is "count" (number of lines with the token), "flag" (1 if any line has the token)
+    or "last" (value_pattern matched right after the last token of the log)
+    """
+    counter: str
+    token: str
+    kind: str = "count"
+    value_pattern: str = None
+    value_type: Callable = None
+    default: Any = 0
+
+
+def header_value(header: str) -> str:
+    """
+    Header text of the output files, the rows keep the raw header until header_columns
+    """
+    return header.replace(";", "-")
+
+
+# Only the cannon markers of LogHelper must be added here, the order is the order of the CSV columns
+# The header must be the first, nothing before of the official header is counted
+HEADER_MARKER = 0
+LOG_MARKERS = [
+    LogMarker(counter="header", token="#HEADER", kind="last", value_pattern=r"(.*)", value_type=str, default=None),
+    LogMarker(counter="#SDC", token="SDC"),
+    LogMarker(counter="#appcrash", token="soft APP reboot"),
+    LogMarker(counter="#abort", token="ABORT"),
+    LogMarker(counter="#syscrash", token="power cycle"),
+    LogMarker(counter="#end", token="END", kind="flag"),
+    LogMarker(counter="acc_err", token="AccErr:", kind="last", value_pattern=r"(\d+)", value_type=int),
+    LogMarker(counter="acc_time", token="AccTime:", kind="last", value_pattern=r"(\d+.\d+)", value_type=float),
+    # TODO: Add on the log helper a way to write framework errors
+]
+
+_marker_scanner = None
+
+
+def register_marker(counter: str, token: str, kind: str = "count", value_pattern: str = None,
+                    value_type: Callable = None, default: Any = 0):
+    """
+    Add a marker to the scanner, e.g. register_marker("#framework_error", "CUDA Framework error")
+    The counter is added as a new CSV column before file_path
+    """
+    global _marker_scanner
+    new_marker = LogMarker(counter=counter, token=token, kind=kind, value_pattern=value_pattern,
+                           value_type=value_type, default=default)
+    for marker in LOG_MARKERS:
+        if marker.counter == counter:
+            # Forked workers inherit the markers already registered by the main process
+            if marker == new_marker:
+                return
+            raise ValueError(f"Marker counter {counter} already registered with token {marker.token}")
+    LOG_MARKERS.append(new_marker)
+    _marker_scanner = None
+
+
+def register_extra_markers(extra_markers: list):
+    """
+    Register "count" markers given as (counter, token) pairs, also used as the worker pool initializer
+    """
+    for counter, token in extra_markers:
+        register_marker(counter=counter, token=token)
+
+
+def tokens_overlap(tokens: list) -> bool:
+    """
+    True if two occurrences of the tokens can share characters in a line
+    (a suffix of one token is a prefix of another, or a token contains another)
+    """
+    for token in tokens:
+        for other in tokens:
+            if token != other and other in token:
+                return True
+            if any(token.endswith(other[:size]) for size in range(1, min(len(token), len(other)))):
+                return True
+    return False
+
+
+def get_marker_scanner():
+    """
+    Compile all the marker tokens into a single alternation regex, one findall pass per line
+    returns every token in the line. When the tokens can overlap the alternation is placed inside
+    a lookahead, so overlapping tokens are reported too
+    :return: (compiled scanner, dict token -> marker indexes, list with the compiled value patterns)
+    """
+    global _marker_scanner
+    if _marker_scanner is None:
+        tokens = list(dict.fromkeys(marker.token for marker in LOG_MARKERS))
+        # Longest first, a token that is a prefix of the matched one is reported together with it
+        tokens.sort(key=len, reverse=True)
+        alternation = "|".join(re.escape(token) for token in tokens)
+        if tokens_overlap(tokens):
+            scanner = re.compile(f"(?=({alternation}))")
+        else:
+            scanner = re.compile(alternation)
+        token_markers = {token: [i for i, marker in enumerate(LOG_MARKERS) if token.startswith(marker.token)]
+                         for token in tokens}
+        value_res = [re.compile(marker.value_pattern) if marker.value_pattern else None for marker in LOG_MARKERS]
+        _marker_scanner = scanner, token_markers, value_res
+    return _marker_scanner
+
+
+def last_marker_value(line: str, marker: LogMarker, value_re: re.Pattern):
+    """
+    Same as re.match(".*<token><value pattern>", line), the last token followed by a valid value wins
+    :return: the converted value or None if no token in the line is followed by a valid value
+    """
+    token_pos = line.rfind(marker.token)
+    while token_pos >= 0:
+        value_m = value_re.match(line, token_pos + len(marker.token))
+        if value_m:
+            return marker.value_type(value_m.group(1))
+        token_pos = line.rfind(marker.token, 0, token_pos + len(marker.token) - 1)
+    return None
+
+
+class LogScanner:
+    """
+    Marker counters of one log, the lines can be fed in several pieces,
+    e.g. while the log is still being written
+    """
+
+    def __init__(self, events: bool = False):
+        """
+        :param events: also keep one event for each line counted by a "count" marker (SDC, ABORT, reboots, ...)
+        """
+        self.scanner, self.token_markers, self.value_res = get_marker_scanner()
+        self.values = [marker.default for marker in LOG_MARKERS]
+        self.header = None
+        self.line_count = 0
+        # [counter, line number, iteration, acc_time, line timestamp or None] of each event
+        self.events = list() if events else None
+        self.iteration = -1
+        self.acc_time_index = [marker.counter for marker in LOG_MARKERS].index("acc_time")
+
+    def feed(self, lines):
+        """
+        Count the markers of the next lines of the log
+        :param lines: iterable with complete text lines
+        """
+        scanner, token_markers, value_res = self.scanner, self.token_markers, self.value_res
+        markers = LOG_MARKERS
+        values = self.values
+        header = self.header
+        events = self.events
+        line_number = self.line_count
+        for line_number, line in enumerate(lines, self.line_count + 1):
+            tokens = scanner.findall(line)
+            if not tokens:
+                continue
+            found = set()
+            for token in tokens:
+                found.update(token_markers[token])
+            # Continue until a header is found
+            # This is to guarantee that nothing before of the official header will be counted
+            if header is None and HEADER_MARKER not in found:
+                continue
+
+            for i in found:
+                marker = markers[i]
+                if marker.kind == "count":
+                    values[i] += 1
+                elif marker.kind == "flag":
+                    values[i] = 1
+                else:
+                    value = last_marker_value(line=line, marker=marker, value_re=value_res[i])
+                    if value is not None:
+                        values[i] = value
+            header = values[HEADER_MARKER]
+            if events is not None:
+                self.add_events(line=line, line_number=line_number, found=found)
+        self.header = header
+        self.line_count = line_number
+
+    def add_events(self, line: str, line_number: int, found: set):
+        iteration_m = ITERATION_RE.search(line)
+        if iteration_m:
+            self.iteration = int(iteration_m.group(1))
+        line_time = None
+        for i in sorted(found):
+            if LOG_MARKERS[i].kind != "count":
+                continue
+            if line_time is None:
+                line_time_m = LINE_TIME_RE.search(line)
+                line_time = datetime(*map(int, line_time_m.groups())).isoformat() if line_time_m else ""
+            self.events.append([LOG_MARKERS[i].counter, line_number, self.iteration,
+                                self.values[self.acc_time_index], line_time or None])
+
+    def counters(self) -> dict:
+        return {marker.counter: value for marker, value in zip(LOG_MARKERS, self.values)}
+
+    def scan(self, lines) -> dict:
+        """
+        Same as parse_log_lines, but the scanner is kept, e.g. to read its events
+        """
+        self.feed(lines)
+        return self.counters()
+
+
+def parse_log_lines(lines) -> dict:
+    """
+    Count the LogHelper markers of one log
+    :param lines: iterable with the text lines of the log
+    :return: dict with the counters of the log
+    """
+    log_scanner = LogScanner()
+    log_scanner.feed(lines)
+    return log_scanner.counters()
+
+
+def parse_log(log_path: str, log_data, scan: Callable = parse_log_lines):
+    """
+    Build the CSV row of one log
+    :param log_path: path of the log, it is stored in the file_path column
+    :param log_data: iterable with the text lines of the log, or its raw bytes when scan is scan_log_bytes
+    :param scan: function that counts the markers of log_data
+    :return: the row dict or None if the log name is not a LogHelper one
+    """
+    log_name = parse_log_name(log_path)
+    if log_name is None:
+        return None
+    start_dt, benchmark, machine_name = log_name
+    counters = scan(log_data)
+    new_line_dict = {"time": start_dt, "machine": machine_name, "benchmark": benchmark}
+    new_line_dict.update(counters)
+    new_line_dict["file_path"] = log_path
+    return new_line_dict
+
+
+def scan_log_bytes(log_bytes) -> dict:
+    """
+    Count the LogHelper markers searching the tokens directly on the raw bytes of one log (e.g. a mmap),
+    same result as parse_log_lines. Only the text after the value markers (AccTime:, AccErr:, #HEADER)
+    is decoded, the lines that are only counted are never decoded
+    :param log_bytes: bytes-like object with the whole log
+    :return: dict with the counters of the log
+    """
+    encoding = locale.getpreferredencoding(False)
+    _, _, value_res = get_marker_scanner()
+    markers = LOG_MARKERS
+    values = [marker.default for marker in markers]
+
+    def line_end(pos: int) -> int:
+        # Text mode splits the lines on \n, \r\n and \r
+        newline_m = BYTES_NEWLINE_RE.search(log_bytes, pos)
+        return newline_m.start() if newline_m else len(log_bytes)
+
+    # Nothing before the line of the first header is counted
+    header_pos = log_bytes.find(markers[HEADER_MARKER].token.encode(encoding))
+    if header_pos < 0:
+        return {marker.counter: value for marker, value in zip(markers, values)}
+    start = max(log_bytes.rfind(b"\n", 0, header_pos), log_bytes.rfind(b"\r", 0, header_pos)) + 1
+
+    for i, marker in enumerate(markers):
+        token = marker.token.encode(encoding)
+        if marker.kind == "count":
+            # One count per line, after a hit the search continues on the next line
+            count, token_pos = 0, log_bytes.find(token, start)
+            while token_pos >= 0:
+                count += 1
+                token_pos = log_bytes.find(token, line_end(token_pos + len(token)))
+            values[i] += count
+        elif marker.kind == "flag":
+            if log_bytes.find(token, start) >= 0:
+                values[i] = 1
+        else:
+            # From the end of the log, the first token followed by a valid value is the last value
+            token_pos = log_bytes.rfind(token, start)
+            while token_pos >= 0:
+                value_start = token_pos + len(token)
+                value_m = value_res[i].match(log_bytes[value_start:line_end(value_start)].decode(encoding))
+                if value_m:
+                    values[i] = marker.value_type(value_m.group(1))
+                    break
+                token_pos = log_bytes.rfind(token, start, token_pos + len(token) - 1)
+    return {marker.counter: value for marker, value in zip(markers, values)}
+
+
+class HashingReader(io.RawIOBase):
+    """
+    Binary stream that hashes all the bytes read through it
+    """
+
+    def __init__(self, stream, digest):
+        super().__init__()
+        self.stream = stream
+        self.digest = digest
+        # Bytes read so far
+        self.size = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        size = self.stream.readinto(buffer)
+        self.digest.update(memoryview(buffer)[:size])
+        self.size += size
+        return size
+
+
+def file_hash(file_path: str) -> str:
+    """
+    Content hash of a file, the same one parse_log_entry records in the manifest
+    """
+    digest = hashlib.blake2b(digest_size=HASH_SIZE)
+    with open(file_path, "rb") as fp:
+        for chunk in iter(lambda: fp.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ParseOptions(NamedTuple):
+    """
+    Options of the parse tasks, they go to the workers with each task
+    """
+    use_mmap: bool = False
+    events: bool = False
+    # Extraction dir of the archives, its logs are reported with their archive path
+    workspace: str = None
+    # Add the parse time and the number of lines of each log to its entry, for --stats
+    stats: bool = False
+    # Logs selected by name, the others are never read
+    log_filter: LogFilter = LogFilter()
+
+
+def parse_log_entry(log_path: str, binary_stream, size: int, mtime: float, options: ParseOptions):
+    """
+    Parse one log and hash its content on the same read
+    :param log_path: path of the log, it is stored in the file_path column
+    :param binary_stream: binary stream with the log content
+    :param size: size of the log in bytes, None when it is unknown, the bytes read are recorded instead
+    :param mtime: modification time of the log
+    :param options: parse options, with options.events the entry also has the events of the log
+    :return: manifest entry dict with size, mtime, hash and row, or None if the log is not selected by
+             options.log_filter
+    """
+    if not options.log_filter.accepts(log_path):
+        return None
+    digest = hashlib.blake2b(digest_size=HASH_SIZE)
+    log_scanner = LogScanner(events=options.events)
+    hashing_reader = HashingReader(binary_stream, digest)
+    with io.TextIOWrapper(io.BufferedReader(hashing_reader)) as lines:
+        new_line_dict = parse_log(log_path=log_path, log_data=lines, scan=log_scanner.scan)
+    if size is None:
+        size = hashing_reader.size
+    entry = {"size": size, "mtime": mtime, "hash": digest.hexdigest(), "row": new_line_dict}
+    if options.events:
+        entry["events"] = log_scanner.events
+    if options.stats:
+        entry["stats"] = {"lines": log_scanner.line_count}
+    return entry
+
+
+def count_lines(log_bytes) -> int:
+    """
+    Number of lines of a mmap'ed log, read in chunks
+    """
+    lines = sum(log_bytes[start:start + HASH_CHUNK_SIZE].count(b"\n")
+                for start in range(0, len(log_bytes), HASH_CHUNK_SIZE))
+    # The last line may have no line break
+    return lines + (log_bytes[-1:] not in (b"", b"\n"))
+
+
+def parse_mapped_log_entry(log_path: str, fp, size: int, mtime: float, options: ParseOptions):
+    """
+    Same as parse_log_entry, but the log file is mmap'ed and scanned with scan_log_bytes, without events
+    :param fp: log file opened in binary mode
+    :return: manifest entry dict with size, mtime, hash and row, or None if the log is not selected
+    """
+    if not options.log_filter.accepts(log_path):
+        return None
+    if size == 0:
+        # Empty files cannot be mapped
+        return parse_log_entry(log_path=log_path, binary_stream=fp, size=size, mtime=mtime,
+                               options=ParseOptions(stats=options.stats, log_filter=options.log_filter))
+    with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as log_bytes:
+        return parse_log_bytes_entry(log_path=log_path, log_bytes=log_bytes, size=size, mtime=mtime,
+                                     options=options)
+
+
+def parse_log_bytes_entry(log_path: str, log_bytes, size: int, mtime: float, options: ParseOptions):
+    """
+    Same as parse_mapped_log_entry, for a log already in memory
+    :param log_bytes: bytes-like object with the whole log
+    :return: manifest entry dict with size, mtime, hash and row, or None if the log is not selected
+    """
+    if not options.log_filter.accepts(log_path):
+        return None
+    digest = hashlib.blake2b(log_bytes, digest_size=HASH_SIZE)
+    new_line_dict = parse_log(log_path=log_path, log_data=log_bytes, scan=scan_log_bytes)
+    entry = {"size": size, "mtime": mtime, "hash": digest.hexdigest(), "row": new_line_dict}
+    if options.stats:
+        entry["stats"] = {"lines": count_lines(log_bytes)}
+    return entry
+
+
+def parse_log_files(log_paths: list, options: ParseOptions) -> dict:
+    """
+    Parse a batch of log files that are on disk
+    :param log_paths: list of log paths
+    :param options: parse options, with options.use_mmap the raw bytes of the mmap'ed logs are scanned
+    :return: dict log path -> manifest entry of the LogHelper logs in the batch
+    """
+    entries = dict()
+    for log_path in log_paths:
+        start = time.perf_counter()
+        fi = archive_member_path(log_path=log_path, workspace=options.workspace)
+        with open(log_path, "rb", buffering=0) as fp:
+            stat = os.fstat(fp.fileno())
+            if options.use_mmap:
+                entry = parse_mapped_log_entry(log_path=fi, fp=fp, size=stat.st_size, mtime=stat.st_mtime,
+                                               options=options)
+            else:
+                entry = parse_log_entry(log_path=fi, binary_stream=fp, size=stat.st_size, mtime=stat.st_mtime,
+                                        options=options)
+        if entry:
+            if options.stats:
+                entry["stats"]["seconds"] = time.perf_counter() - start
+            entries[fi] = entry
+    return entries
+
+
+def read_tar_members(archive_file, archive_path: str):
+    """
+    Stream the members of a tar archive, the compression (gz, xz, bz2) is detected by tarfile
+    :param archive_file: binary file with the archive
+    :param archive_path: path of the archive
+    :return: generator of (member name, binary stream, size, mtime)
+    """
+    # Members are read in archive order, so the compressed stream only seeks forward
+    with tarfile.open(archive_path, "r:*", fileobj=archive_file) as tar:
+        yield from tar_members(tar=tar)
+
+
+def read_zstd_tar_members(archive_file, archive_path: str):
+    """
+    Stream the members of a .tar.zst archive, with compression.zstd (Python 3.14) or the zstandard package
+    """
+    if importlib.util.find_spec("compression") is not None and importlib.util.find_spec("compression.zstd"):
+        from compression import zstd
+        zstd_stream = zstd.open(archive_file, "rb")
+    elif importlib.util.find_spec("zstandard") is not None:
+        import zstandard
+        zstd_stream = zstandard.ZstdDecompressor().stream_reader(archive_file, closefd=False)
+    else:
+        raise ImportError(f"reading {archive_path} needs the zstandard package, install it with: pip install zstandard")
+    # The zstd stream is not seekable, the tar is read in stream mode
+    with zstd_stream, tarfile.open(fileobj=zstd_stream, mode="r|") as tar:
+        yield from tar_members(tar=tar)
+
+
+def tar_members(tar: tarfile.TarFile):
+    """
+    Regular members of an open tar archive that are logs or archives
+    :return: generator of (member name, binary stream, size, mtime)
+    """
+    for member in tar:
+        if not member.isfile() or not is_archive_member(member.name):
+            continue
+        with tar.extractfile(member) as member_file:
+            yield member.name, member_file, member.size, member.mtime
+
+
+def read_zip_members(archive_file, archive_path: str):
+    """
+    Stream the members of a zip archive
+    """
+    with zipfile.ZipFile(archive_file) as zip_file:
+        for member in zip_file.infolist():
+            if member.is_dir() or not is_archive_member(member.filename):
+                continue
+            with zip_file.open(member) as member_file:
+                yield member.filename, member_file, member.file_size, time.mktime(member.date_time + (0, 0, -1))
+
+
+def read_gzip_log(archive_file, archive_path: str):
+    """
+    Stream a single gzip compressed log, its only member is the log name without .gz.
+    Its size is unknown (None), the gzip trailer only has the uncompressed size modulo 2^32
+    """
+    with gzip.GzipFile(fileobj=archive_file, mode="rb") as member_file:
+        # The mtime of the gzip header is known once the header is read
+        member_file.peek(1)
+        yield os.path.basename(archive_path)[:-len(".gz")], member_file, None, member_file.mtime
+
+
+# Archive readers by file suffix, each one streams the log and archive members of an archive file
+ARCHIVE_READERS = {
+    ".tar.gz": read_tar_members,
+    ".tgz": read_tar_members,
+    ".tar.xz": read_tar_members,
+    ".tar.bz2": read_tar_members,
+    ".tar": read_tar_members,
+    ".tar.zst": read_zstd_tar_members,
+    ".zip": read_zip_members,
+    ".log.gz": read_gzip_log,
+}
+# Errors of a corrupt or unreadable archive, the archive is reported and skipped
+ARCHIVE_ERRORS = (tarfile.TarError, zipfile.BadZipFile, lzma.LZMAError, zlib.error, EOFError, OSError, ImportError)
+# Archives nested deeper than this are skipped
+MAX_ARCHIVE_DEPTH = 8
+# Nested archives are copied to a seekable file, in memory up to this size
+NESTED_SPOOL_SIZE = 64 << 20
+
+
+def archive_reader(file_path: str):
+    """
+    :return: reader of ARCHIVE_READERS for the suffix of file_path, or None if it is not an archive
+    """
+    for suffix, reader in ARCHIVE_READERS.items():
+        if file_path.endswith(suffix):
+            return reader
+    return None
+
+
+def is_archive_member(member_name: str) -> bool:
+    """
+    Archive members that are read, the logs and the nested archives
+    """
+    return member_name.endswith(".log") or archive_reader(member_name) is not None
+
+
+def spool_member(member_file, max_size: int):
+    """
+    Copy a member stream that cannot seek, or that is gone once the next member is read.
+    A plain temporary file is used above max_size, SpooledTemporaryFile has no seekable or readinto before 3.11
+    :param member_file: binary stream of the member
+    :param max_size: largest member kept in memory
+    :return: (the bytes of the member, or a temporary file at its start when it is bigger than max_size, its size)
+    """
+    head = member_file.read(max_size + 1)
+    if len(head) <= max_size:
+        return head, len(head)
+    spool_file = tempfile.TemporaryFile()
+    spool_file.write(head)
+    del head
+    shutil.copyfileobj(member_file, spool_file, HASH_CHUNK_SIZE)
+    size = spool_file.tell()
+    spool_file.seek(0)
+    return spool_file, size
+
+
+def read_archive_members(archive_path: str, archive_file=None, depth: int = 0):
+    """
+    Stream the *.log members of an archive with the reader of its suffix, recursing into the nested archives.
+    The logs of a nested archive are named <nested archive member>/<log member>
+    :param archive_path: path of the archive, or its member name when nested
+    :param archive_file: seekable binary file with the archive, archive_path is opened when None
+    :param depth: nesting depth of the archive
+    :return: generator of (member name, binary stream, size, mtime), the size is None when it is unknown until
+             the member is read
+    """
+    if archive_file is None:
+        with open(archive_path, "rb") as archive_file:
+            yield from read_archive_members(archive_path=archive_path, archive_file=archive_file, depth=depth)
+        return
+
+    for member_name, member_file, size, mtime in archive_reader(archive_path)(archive_file, archive_path):
+        if member_name.endswith(".log"):
+            yield member_name, member_file, size, mtime
+        elif depth + 1 > MAX_ARCHIVE_DEPTH:
+            print(f"Skipping {member_name} of {archive_path}, archives nested more than {MAX_ARCHIVE_DEPTH} deep")
+        else:
+            # The members of the outer archive cannot always seek, which zip and gzip need
+            nested_content, _ = spool_member(member_file=member_file, max_size=NESTED_SPOOL_SIZE)
+            with io.BytesIO(nested_content) if isinstance(nested_content, bytes) else nested_content as nested_file:
+                for nested_name, nested_member, nested_size, nested_mtime in read_archive_members(
+                        archive_path=member_name, archive_file=nested_file, depth=depth + 1):
+                    yield os.path.join(member_name, nested_name), nested_member, nested_size, nested_mtime
+
+
+def parse_archive_file(archive_path: str, options: ParseOptions) -> dict:
+    """
+    Stream the *.log members of an archive and parse them without extracting anything
+    :param archive_path: path of the archive
+    :param options: parse options, the members are always scanned as text
+    :return: dict member path -> manifest entry of the LogHelper logs in the archive
+    """
+    entries = dict()
+    try:
+        start = time.perf_counter()
+        for member_name, member_file, size, mtime in read_archive_members(archive_path):
+            fi = os.path.join(archive_path, member_name)
+            entry = parse_log_entry(log_path=fi, binary_stream=member_file, size=size, mtime=mtime, options=options)
+            if entry:
+                if options.stats:
+                    # Includes the decompression of the member
+                    entry["stats"]["seconds"] = time.perf_counter() - start
+                entries[fi] = entry
+            start = time.perf_counter()
+    except ARCHIVE_ERRORS as err:
+        print(f"Could not read {archive_path}: {err}")
+    return entries
+
+
+def parse_task(task: tuple) -> tuple:
+    """
+    Worker entry point, a task is ("archive", archive_path, options) or ("logs", [log paths], options)
+    :return: (task, dict log path -> manifest entry)
+    """
+    task_type, task_data, options = task
+    if task_type == "archive":
+        return task, parse_archive_file(archive_path=task_data, options=options)
+    return task, parse_log_files(log_paths=task_data, options=options)
+
+
+def batch_logs(log_paths: list, jobs: int, options: ParseOptions) -> list:
+    """
+    Split the logs in batches, several small files per task keep the IPC overhead low
+    while still giving each worker a few tasks to balance the load
+    """
+    batch_size = min(MAX_LOGS_PER_TASK, max(1, len(log_paths) // (jobs * TASKS_PER_JOB)))
+    return [("logs", log_paths[i:i + batch_size], options) for i in range(0, len(log_paths), batch_size)]
+
+
+def parse_read_ahead_log(item: tuple, options: ParseOptions) -> dict:
+    """
+    Parse one log read by read_ahead_logs, in the scanner or in a worker
+    :param item: (log path, content, size, mtime), the content is the bytes of the log, a spooled file
+                 or None when the log is too big to be read ahead and is read in place
+    :param options: parse options, with options.use_mmap the bytes are scanned without decoding them
+    :return: dict log path -> manifest entry, empty if the log is not a LogHelper one
+    """
+    log_path, content, size, mtime = item
+    if content is None:
+        return parse_log_files(log_paths=[log_path], options=options)
+    start = time.perf_counter()
+    if isinstance(content, bytes) and options.use_mmap and content:
+        entry = parse_log_bytes_entry(log_path=log_path, log_bytes=content, size=size, mtime=mtime, options=options)
+    else:
+        with io.BytesIO(content) if isinstance(content, bytes) else content as binary_stream:
+            entry = parse_log_entry(log_path=log_path, binary_stream=binary_stream, size=size, mtime=mtime,
+                                    options=options)
+    if entry is None:
+        return dict()
+    if options.stats:
+        # Only the scan, the read happened ahead
+        entry["stats"]["seconds"] = time.perf_counter() - start
+    return {log_path: entry}
+
+
+def read_ahead_logs(all_archives: list, all_logs_list: list, read_queue: queue.Queue, log_filter: LogFilter):
+    """
+    Producer of --pipeline, PIPELINE_READ_THREADS threads read the loose logs and decompress the archive members
+    into read_queue, blocking while it is full. The queue ends with None, after an exception of a reader if any
+    :param all_archives: list of archive paths, each archive is read by one thread as it only reads sequentially
+    :param all_logs_list: list of loose logs
+    :param read_queue: bounded queue of (log path, content, size, mtime) items for parse_read_ahead_log
+    :param log_filter: the logs and members it does not select are not read
+    """
+
+    def read_log(log_path: str):
+        if not log_filter.accepts(log_path):
+            return
+        with open(log_path, "rb") as fp:
+            stat = os.fstat(fp.fileno())
+            content = fp.read() if stat.st_size <= PIPELINE_MAX_BUFFERED else None
+        read_queue.put((log_path, content, stat.st_size, stat.st_mtime))
+
+    def read_archive(archive_path: str):
+        try:
+            for member_name, member_file, size, mtime in read_archive_members(archive_path):
+                fi = os.path.join(archive_path, member_name)
+                if not log_filter.accepts(fi):
+                    continue
+                if size is not None and size <= PIPELINE_MAX_BUFFERED:
+                    content = member_file.read()
+                else:
+                    # The member stream is gone once the next member is read. A member of unknown size is spooled
+                    # too, it is kept in memory only up to PIPELINE_MAX_BUFFERED
+                    content, size = spool_member(member_file=member_file, max_size=PIPELINE_MAX_BUFFERED)
+                read_queue.put((fi, content, size, mtime))
+        except ARCHIVE_ERRORS as err:
+            print(f"Could not read {archive_path}: {err}")
+
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=PIPELINE_READ_THREADS) as executor:
+            futures = [executor.submit(read_archive, archive_path) for archive_path in all_archives]
+            futures += [executor.submit(read_log, log_path) for log_path in all_logs_list]
+            for future in futures:
+                future.result()
+    except Exception as err:
+        read_queue.put(err)
+    finally:
+        read_queue.put(None)
+
+
+def run_pipeline(all_archives: list, all_logs_list: list, jobs: int, extra_markers: list,
+                 options: ParseOptions) -> list:
+    """
+    --pipeline, the logs are read ahead by read_ahead_logs while the scanner parses the logs already read, so the
+    reads of slow (e.g. network) storage overlap with the parsing instead of adding to it. The archives are
+    streamed, as with --stream. With jobs > 1 the scanner hands the logs to a pool of jobs processes, with at
+    most TASKS_PER_JOB logs per process in flight
+    :param extra_markers: (counter, token) pairs already registered in this process, the workers register them too
+    :return: list of manifest entries, in completion order
+    """
+    read_queue = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    # Daemon, a reader blocked on the full queue must not keep the process alive after an error of the scanner
+    threading.Thread(target=read_ahead_logs, args=(all_archives, all_logs_list, read_queue, options.log_filter),
+                     daemon=True).start()
+    entries = list()
+    if jobs == 1:
+        for item in iter(read_queue.get, None):
+            if isinstance(item, Exception):
+                raise item
+            entries.extend(parse_read_ahead_log(item=item, options=options).values())
+        return entries
+
+    in_flight = threading.BoundedSemaphore(jobs * TASKS_PER_JOB)
+    errors = list()
+
+    def parsed(task_entries: dict):
+        entries.extend(task_entries.values())
+        in_flight.release()
+
+    def failed(err: BaseException):
+        errors.append(err)
+        in_flight.release()
+
+    with multiprocessing.Pool(processes=jobs, initializer=register_extra_markers,
+                              initargs=(extra_markers,)) as pool:
+        for item in iter(read_queue.get, None):
+            if isinstance(item, Exception):
+                raise item
+            if errors:
+                raise errors[0]
+            if item[1] is not None and not isinstance(item[1], bytes):
+                # Spooled members cannot be sent to the workers
+                entries.extend(parse_read_ahead_log(item=item, options=options).values())
+                continue
+            in_flight.acquire()
+            pool.apply_async(parse_read_ahead_log, (item, options), callback=parsed, error_callback=failed)
+        pool.close()
+        pool.join()
+    if errors:
+        raise errors[0]
+    return entries
+
+
+def remove_stale_workspaces(tmp_dir: str):
+    """
+    Remove the extraction dirs left in tmp_dir by the runs that were killed before their cleanup,
+    the dirs of the runs still alive are kept
+    """
+    for dir_entry in os.scandir(tmp_dir):
+        workspace_m = re.fullmatch(rf"{WORKSPACE_PREFIX}(\d+)_.*", dir_entry.name)
+        if not workspace_m or not dir_entry.is_dir(follow_symlinks=False):
+            continue
+        if dir_entry.stat(follow_symlinks=False).st_uid != os.getuid():
+            continue
+        try:
+            os.kill(int(workspace_m.group(1)), 0)
+        except (ProcessLookupError, OverflowError):
+            print(f"Removing the extraction dir of a killed run: {dir_entry.path}")
+            shutil.rmtree(dir_entry.path, ignore_errors=True)
+        except PermissionError:
+            pass
+
+
+def extract_archive(archive_path: str, workspace: str, log_filter: LogFilter = LogFilter()) -> list:
+    """
+    Extract the *.log members of one archive to <workspace>/<archive path>/, so its logs keep
+    a distinct and stable path
+    :param archive_path: path of the archive
+    :param workspace: extraction dir owned by this run
+    :param log_filter: the members it does not select are skipped without being written
+    :return: list with the extracted logs
+    """
+    destination = os.path.join(workspace, os.path.relpath(archive_path))
+    extracted_logs = list()
+    try:
+        # Members are extracted in archive order, the compressed stream is decompressed only once
+        for member_name, member_file, _, mtime in read_archive_members(archive_path):
+            if not log_filter.accepts(member_name):
+                continue
+            log_path = os.path.normpath(os.path.join(destination, member_name))
+            # Absolute member names and ../ must not escape the destination
+            if not log_path.startswith(destination + os.sep):
+                print(f"Skipping {member_name} of {archive_path}, it is outside of the archive dir")
+                continue
+            os.makedirs(os.path.dirname(log_path), exist_ok=True)
+            with open(log_path, "wb") as log_file:
+                shutil.copyfileobj(member_file, log_file, HASH_CHUNK_SIZE)
+            os.utime(log_path, (mtime, mtime))
+            extracted_logs.append(log_path)
+    except ARCHIVE_ERRORS as err:
+        print(f"Could not extract {archive_path}: {err}")
+    return extracted_logs
+
+
+def extract_logs(all_archives: list, workspace: str, jobs: int, log_filter: LogFilter = LogFilter()) -> list:
+    """
+    Extract the archives into the private workspace of this run, several at once in a thread pool,
+    the decompression and the file writes release the GIL
+    :param all_archives: list of archive paths
+    :param workspace: extraction dir owned by this run
+    :param jobs: number of extraction threads
+    :return: list with the extracted logs, in the order of all_archives
+    """
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        return [log_path for extracted_logs in executor.map(extract_archive, all_archives,
+                                                             [workspace] * len(all_archives),
+                                                             [log_filter] * len(all_archives))
+                for log_path in extracted_logs]
+
+
+def archive_member_path(log_path: str, workspace: str) -> str:
+    """
+    Path of a log reported in the file_path column, the logs extracted into the workspace
+    are reported as <archive path>/<member name>, the same path as with --stream
+    """
+    if workspace is None or not log_path.startswith(workspace + os.sep):
+        return log_path
+    return os.path.join(os.curdir, os.path.relpath(log_path, workspace))
+
+
+def dedupe_log_files(log_paths: list, workspace: str = None) -> list:
+    """
+    Drop the copies of a log before parsing, a copy has the same file name and content as another log.
+    Only the logs with the same file name and size are hashed, the copies are never parsed.
+    The copy with the first reported path is kept, the same one dedupe_entries keeps in the other modes
+    :param log_paths: list of log paths
+    :param workspace: extraction dir of the archives, see archive_member_path
+    :return: list of log paths without the copies, in the order of log_paths
+    """
+    same_name_size = dict()
+    for log_path in log_paths:
+        same_name_size.setdefault((os.path.basename(log_path), os.path.getsize(log_path)), list()).append(log_path)
+
+    copies = set()
+    for same_logs in same_name_size.values():
+        if len(same_logs) > 1:
+            seen_hashes = set()
+            for log_path in sorted(same_logs, key=lambda path: archive_member_path(log_path=path, workspace=workspace)):
+                log_hash = file_hash(log_path)
+                if log_hash in seen_hashes:
+                    copies.add(log_path)
+                seen_hashes.add(log_hash)
+    if copies:
+        print(f"Skipping {len(copies)} copies of logs already found")
+    return [log_path for log_path in log_paths if log_path not in copies]
+
+
+def dedupe_entries(entries: list) -> list:
+    """
+    Drop the entries of the log copies, with the same file name and content hash,
+    keeping the first file_path of each log so the result does not depend on the parse order
+    :param entries: list of manifest entries
+    :return: list of manifest entries without the copies
+    """
+    unique_entries = dict()
+    for entry in sorted(entries, key=lambda e: e["row"]["file_path"]):
+        unique_entries.setdefault((os.path.basename(entry["row"]["file_path"]), entry["hash"]), entry)
+    if len(unique_entries) < len(entries):
+        print(f"Skipping {len(entries) - len(unique_entries)} copies of logs already parsed")
+    return list(unique_entries.values())
+
+
+def walk_files(top: str = os.curdir):
+    """
+    The files under top in the same order as os.walk, read in one os.scandir pass per dir.
+    The symlinked dirs are not followed and the dirs that cannot be listed are skipped, as with os.walk
+    :return: generator of os.DirEntry
+    """
+    dirs = [top]
+    while dirs:
+        sub_dirs = list()
+        try:
+            dir_entries = os.scandir(dirs.pop())
+        except OSError:
+            continue
+        with dir_entries:
+            for dir_entry in dir_entries:
+                try:
+                    is_dir = dir_entry.is_dir()
+                except OSError:
+                    is_dir = False
+                if not is_dir:
+                    yield dir_entry
+                elif not dir_entry.is_symlink():
+                    sub_dirs.append(dir_entry.path)
+        # Depth first, the sub dirs in listing order
+        dirs.extend(reversed(sub_dirs))
+
+
+def discover_logs(log_filter: LogFilter = LogFilter()):
+    """
+    Find the archives of the ARCHIVE_READERS types and the loose logs under the current dir in a single walk.
+    The loose logs are selected by log_filter on their name, without opening them, the members of the archives
+    are selected when the archives are read
+    :return: (list of archives, list of loose logs)
+    """
+    suffixes = list(ARCHIVE_READERS)
+    all_archives, all_logs_list = list(), list()
+    for _, dir_entries in itertools.groupby(walk_files(), key=lambda dir_entry: os.path.dirname(dir_entry.path)):
+        dir_archives = list()
+        for dir_entry in dir_entries:
+            # Hidden files are skipped, as with glob
+            if dir_entry.name.startswith("."):
+                continue
+            if dir_entry.name.endswith(".log"):
+                if log_filter.accepts(dir_entry.name):
+                    all_logs_list.append(dir_entry.path)
+                continue
+            suffix = next((suffix for suffix in suffixes if dir_entry.name.endswith(suffix)), None)
+            if suffix is not None:
+                dir_archives.append((suffixes.index(suffix), dir_entry.path))
+        # The archives of each dir are listed by type, then in listing order
+        all_archives.extend(archive_path for _, archive_path in sorted(dir_archives, key=lambda a: a[0]))
+    return all_archives, all_logs_list
+
+
+class RunStats:
+    """
+    Wall and CPU time of the stages of a run, the CPU time includes the worker processes once they are joined
+    """
+
+    def __init__(self):
+        self.stages = dict()
+        self.start = time.perf_counter(), self.cpu_time()
+
+    @staticmethod
+    def cpu_time() -> float:
+        times = os.times()
+        return times.user + times.system + times.children_user + times.children_system
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        """
+        Time the code of the with block as the stage name, the times of a stage run several times are added
+        """
+        wall, cpu = time.perf_counter(), self.cpu_time()
+        try:
+            yield
+        finally:
+            stage = self.stages.setdefault(name, {"wall": 0.0, "cpu": 0.0})
+            stage["wall"] += time.perf_counter() - wall
+            stage["cpu"] += self.cpu_time() - cpu
+
+    def report(self, entries: list, slowest: int, jobs: int) -> dict:
+        """
+        :param entries: manifest entries, only the ones parsed in this run have stats
+        :param slowest: number of slowest logs to list
+        :param jobs: number of worker processes of the run
+        :return: dict with the stage times, the throughput and the slowest logs
+        """
+        parsed = [entry for entry in entries if "stats" in entry]
+        total_wall = time.perf_counter() - self.start[0]
+        total_cpu = self.cpu_time() - self.start[1]
+        parse_wall = self.stages.get("parse", {"wall": 0.0})["wall"]
+        files = len(parsed)
+        lines = sum(entry["stats"]["lines"] for entry in parsed)
+        size = sum(entry["size"] for entry in parsed)
+
+        def rates(seconds):
+            seconds = max(seconds, 1e-9)
+            return {"files_per_s": files / seconds, "lines_per_s": lines / seconds, "mb_per_s": size / 1e6 / seconds}
+
+        slowest_logs = sorted(parsed, key=lambda entry: entry["stats"]["seconds"], reverse=True)[:slowest]
+        return {"jobs": jobs, "stages": self.stages, "total": {"wall": total_wall, "cpu": total_cpu},
+                "files": files, "lines": lines, "bytes": size,
+                "parse_throughput": rates(parse_wall), "total_throughput": rates(total_wall),
+                "slowest": [{"file_path": entry["row"]["file_path"], "size": entry["size"],
+                             "lines": entry["stats"]["lines"], "seconds": entry["stats"]["seconds"]}
+                            for entry in slowest_logs]}
+
+
+def print_stats(stats: dict):
+    """
+    Print the report of RunStats.report
+    """
+    print(f"\n{'stage':<12}{'wall (s)':>12}{'CPU (s)':>12}")
+    for name, stage in list(stats["stages"].items()) + [("total", stats["total"])]:
+        print(f"{name:<12}{stage['wall']:>12.3f}{stage['cpu']:>12.3f}")
+    print(f"\n{stats['files']} logs, {stats['lines']} lines, {stats['bytes'] / 1e6:.1f} MB, {stats['jobs']} jobs")
+    for name in ("parse_throughput", "total_throughput"):
+        throughput = stats[name]
+        print(f"{name.replace('_', ' ')}: {throughput['files_per_s']:.1f} files/s, "
+              f"{throughput['lines_per_s']:.0f} lines/s, {throughput['mb_per_s']:.1f} MB/s")
+    if stats["slowest"]:
+        print("Slowest logs:")
+        for log in stats["slowest"]:
+            print(f"{log['seconds']:>10.3f} s {log['size'] / 1e6:>10.2f} MB {log['lines']:>10} lines  "
+                  f"{log['file_path']}")
+
+
+def get_parse_tasks(stream: bool, jobs: int, options: ParseOptions, run_stats: RunStats) -> list:
+    """
+    Discover the logs and split them into parse tasks, the loose logs are always read in place
+    :param stream: stream the archive members instead of extracting them to options.workspace
+    :param jobs: number of worker processes, used to size the batches
+    :param options: parse options of the tasks
+    :param run_stats: times the discover, extract and dedupe stages
+    :return: list of tasks for parse_task
+    """
+    with run_stats.stage("discover"):
+        all_archives, all_logs_list = discover_logs(log_filter=options.log_filter)
+    if not stream:
+        with run_stats.stage("extract"):
+            extracted_logs = extract_logs(all_archives=all_archives, workspace=options.workspace, jobs=jobs,
+                                          log_filter=options.log_filter)
+        with run_stats.stage("dedupe"):
+            log_paths = dedupe_log_files(all_logs_list + extracted_logs, workspace=options.workspace)
+        return batch_logs(log_paths=log_paths, jobs=jobs, options=options)
+
+    # Each archive is one task, it can only be read sequentially
+    return [("archive", archive, options) for archive in all_archives] + batch_logs(log_paths=all_logs_list,
+                                                                                   jobs=jobs, options=options)
+
+
+def run_tasks(tasks: list, jobs: int, extra_markers: list):
+    """
+    Run the parse tasks serially or in a pool of jobs processes
+    :param extra_markers: (counter, token) pairs already registered in this process, the workers register them too
+    :return: generator of (task, dict log path -> manifest entry), in completion order
+    """
+    if jobs > 1:
+        with multiprocessing.Pool(processes=jobs, initializer=register_extra_markers,
+                                  initargs=(extra_markers,)) as pool:
+            yield from pool.imap_unordered(parse_task, tasks)
+    else:
+        for task in tasks:
+            yield parse_task(task)
+
+
+def sort_rows(rows: list) -> list:
+    """
+    Streamed and parallel logs come out of order, keep the output in the same order as the extracted run
+    """
+    return sorted(rows, key=lambda r: (os.path.basename(r["file_path"]), r["file_path"]))
+
+
+def header_fields(header: str) -> dict:
+    """
+    Split a raw header into its key:value parameters, the last value of a repeated key wins
+    :return: dict with the string value of each key
+    """
+    return dict(HEADER_PAIR_RE.findall(header)) if header else dict()
+
+
+def as_header_type(value: str, value_type: Callable):
+    """
+    :return: value converted to value_type, None if it is not a value_type
+    """
+    try:
+        return value_type(value)
+    except ValueError:
+        return None
+
+
+def header_value_type(values: collections.Counter) -> Callable:
+    """
+    int if most values are ints, else float if most values are numbers, else str.
+    A few odd values do not turn a numeric parameter into text, they are left empty by as_header_type
+    :param values: Counter with the number of logs of each value
+    """
+    for value_type in (int, float):
+        typed_logs = sum(logs for value, logs in values.items() if as_header_type(value, value_type) is not None)
+        if typed_logs * 2 > sum(values.values()):
+            return value_type
+    return str
+
+
+def header_columns(rows: list) -> list:
+    """
+    Add the interned header_id and one typed header_<key> column per header parameter to the rows, so the
+    cross section scripts group and filter on integers instead of the header text. The ids are dense and follow
+    the order of the header strings, they only match between the files written by the same run.
+    The header parameters and their types are taken from the logs of each machine, so the columns of a machine
+    do not depend on the other machines of the run
+    :param rows: rows sorted by sort_rows, with the raw header
+    :return: new rows with the same order and the header text of header_value, the new columns come right before
+             file_path
+    """
+    headers = sorted(set(header_value(new_line_dict["header"]) for new_line_dict in rows
+                         if new_line_dict["header"] is not None))
+    header_ids = {header: header_id for header_id, header in enumerate(headers)}
+    machine_headers = dict()
+    for new_line_dict in rows:
+        if new_line_dict["header"] is not None:
+            machine_headers.setdefault(new_line_dict["machine"], collections.Counter())[new_line_dict["header"]] += 1
+    fields = {raw_header: header_fields(raw_header)
+              for header_logs in machine_headers.values() for raw_header in header_logs}
+
+    # Typed header columns of each raw header, per machine
+    machine_columns = dict()
+    typed_fields = dict()
+    for machine_name, header_logs in machine_headers.items():
+        key_values = dict()
+        for raw_header, logs in header_logs.items():
+            for key, value in fields[raw_header].items():
+                key_values.setdefault(key, collections.Counter())[value] += logs
+        key_types = {key: header_value_type(values) for key, values in key_values.items()}
+        key_columns = {key: f"{HEADER_COLUMN_PREFIX}{key}" for key in key_values}
+        # A header key named id must not replace the header id
+        key_columns = {key: column + "_" if column == HEADER_ID_COLUMN else column
+                       for key, column in key_columns.items()}
+        machine_columns[machine_name] = list(key_columns.values())
+        # The values are converted once per distinct header, not once per row
+        typed_fields[machine_name] = {
+            raw_header: {key_columns[key]: as_header_type(value, key_types[key])
+                         for key, value in fields[raw_header].items()}
+            for raw_header in header_logs}
+
+    new_rows = list()
+    for new_line_dict in rows:
+        machine_name, raw_header = new_line_dict["machine"], new_line_dict["header"]
+        new_row = {column: value for column, value in new_line_dict.items() if column != "file_path"}
+        if raw_header is not None:
+            new_row["header"] = header_value(raw_header)
+        new_row[HEADER_ID_COLUMN] = header_ids.get(new_row["header"])
+        header_typed_fields = typed_fields.get(machine_name, dict()).get(raw_header, dict())
+        for column in machine_columns.get(machine_name, list()):
+            new_row[column] = header_typed_fields.get(column)
+        new_row["file_path"] = new_line_dict["file_path"]
+        new_rows.append(new_row)
+    return new_rows
+
+
+def new_manifest(events: bool) -> dict:
+    return {"version": MANIFEST_VERSION, "markers": [marker.counter for marker in LOG_MARKERS], "events": events,
+            "logs": dict(), "archives": dict()}
+
+
+def load_manifest(folder_p: str, events: bool) -> dict:
+    """
+    Load the manifest of the last incremental run, a manifest written by another version,
+    with other markers or without the events when they are needed is discarded, so every log is parsed again
+    """
+    manifest_path = os.path.join(folder_p, MANIFEST_FILE)
+    empty_manifest = new_manifest(events=events)
+    if not os.path.isfile(manifest_path):
+        return empty_manifest
+    with open(manifest_path, "r") as fp:
+        manifest = json.load(fp)
+    if manifest.get("version") != MANIFEST_VERSION or manifest.get("markers") != empty_manifest["markers"]:
+        print(f"Manifest {manifest_path} does not match the current markers, parsing all the logs again")
+        return empty_manifest
+    if events and not manifest.get("events"):
+        print(f"Manifest {manifest_path} has no events, parsing all the logs again")
+        return empty_manifest
+    return manifest
+
+
+def manifest_entries(entries: dict) -> dict:
+    """
+    Entries as they are saved in the manifest, without the stats of the run
+    """
+    return {log_path: {key: value for key, value in entry.items() if key != "stats"}
+            for log_path, entry in entries.items()}
+
+
+def save_manifest(folder_p: str, manifest: dict):
+    manifest_path = os.path.join(folder_p, MANIFEST_FILE)
+    saved_manifest = dict(manifest, logs=manifest_entries(manifest["logs"]),
+                          archives={archive_path: dict(archive, logs=manifest_entries(archive["logs"]))
+                                    for archive_path, archive in manifest["archives"].items()})
+    # Write and rename, an interrupted run never leaves a half written manifest
+    with open(f"{manifest_path}.tmp", "w") as fp:
+        json.dump(saved_manifest, fp)
+    os.replace(f"{manifest_path}.tmp", manifest_path)
+
+
+def log_unchanged(log_path: str, stat: os.stat_result, entry: dict) -> bool:
+    """
+    A log is unchanged if it has the same size and mtime of the manifest entry,
+    or the same content hash when only the mtime changed (e.g. the file was copied again)
+    """
+    if entry is None or entry["size"] != stat.st_size:
+        return False
+    if entry["mtime"] == stat.st_mtime:
+        return True
+    if entry["hash"] == file_hash(log_path):
+        entry["mtime"] = stat.st_mtime
+        return True
+    return False
+
+
+def parse_incremental(folder_p: str, jobs: int, extra_markers: list, options: ParseOptions,
+                      run_stats: RunStats) -> list:
+    """
+    Parse only the logs that are new or changed since the last incremental run, the entries of the
+    other logs come from the manifest in folder_p. The logs are read in place, as with --stream
+    :param run_stats: times the discover, manifest and parse stages
+    :return: list with the manifest entries of all the logs
+    """
+    with run_stats.stage("discover"):
+        all_archives, all_logs_list = discover_logs(log_filter=options.log_filter)
+
+    with run_stats.stage("manifest"):
+        manifest = load_manifest(folder_p=folder_p, events=options.events)
+        updated_manifest = new_manifest(events=options.events)
+
+        # Archives are checked by size and mtime, a changed archive is streamed again as a whole
+        changed_archives = dict()
+        for archive_path in all_archives:
+            stat = os.stat(archive_path)
+            archive = manifest["archives"].get(archive_path)
+            if archive and archive["size"] == stat.st_size and archive["mtime"] == stat.st_mtime:
+                updated_manifest["archives"][archive_path] = archive
+            else:
+                changed_archives[archive_path] = stat
+
+        changed_logs = list()
+        for log in all_logs_list:
+            entry = manifest["logs"].get(log)
+            if log_unchanged(log_path=log, stat=os.stat(log), entry=entry):
+                updated_manifest["logs"][log] = entry
+            else:
+                changed_logs.append(log)
+
+    tasks = [("archive", archive_path, options) for archive_path in changed_archives] + batch_logs(
+        log_paths=changed_logs, jobs=jobs, options=options)
+    parsed_logs = 0
+    with run_stats.stage("parse"):
+        for (task_type, task_data, _), entries in run_tasks(tasks=tasks, jobs=jobs, extra_markers=extra_markers):
+            parsed_logs += len(entries)
+            if task_type == "archive":
+                stat = changed_archives[task_data]
+                updated_manifest["archives"][task_data] = {"size": stat.st_size, "mtime": stat.st_mtime,
+                                                           "logs": entries}
+            else:
+                updated_manifest["logs"].update(entries)
+
+    with run_stats.stage("manifest"):
+        save_manifest(folder_p=folder_p, manifest=updated_manifest)
+
+    entries = list(updated_manifest["logs"].values())
+    for archive in updated_manifest["archives"].values():
+        entries.extend(archive["logs"].values())
+    print(f"Parsed {parsed_logs} new or changed logs, {len(entries) - parsed_logs} unchanged logs from the manifest")
+    return entries
+
+
+class MachineCSVWriters:
+    """
+    Pool with one open CSV writer per machine for the whole run, the rows are buffered
+    and flushed in CSV_BUFFER_SIZE blocks instead of reopening the file for each log
+    """
+
+    def __init__(self, folder_p: str, truncate: bool = False, verbose: bool = True):
+        """
+        :param folder_p: folder of the logs_parsed_<machine>.csv files
+        :param truncate: rewrite the files instead of appending to them
+        :param verbose: print the machines when they are seen for the first time
+        """
+        self.folder_p = folder_p
+        self.file_mode = "w" if truncate else "a"
+        self.verbose = verbose
+        self.files = dict()
+        self.writers = dict()
+
+    def __contains__(self, machine_name: str) -> bool:
+        return machine_name in self.writers
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def writerow(self, new_line_dict: dict):
+        machine_name = new_line_dict["machine"]
+        if machine_name not in self.writers:
+            fp = open(os.path.join(self.folder_p, f'logs_parsed_{machine_name}.csv'), self.file_mode,
+                      buffering=CSV_BUFFER_SIZE)
+            self.files[machine_name] = fp
+            self.writers[machine_name] = csv.DictWriter(fp, fieldnames=list(new_line_dict.keys()), delimiter=';')
+            self.writers[machine_name].writeheader()
+            if self.verbose:
+                print(f"Machine first time: {machine_name}")
+        self.writers[machine_name].writerow(new_line_dict)
+
+    def close(self):
+        for fp in self.files.values():
+            fp.close()
+        self.files.clear()
+        self.writers.clear()
+
+
+def dictionary_array(values: list):
+    """
+    Dictionary encoded pyarrow string array, the dictionary is sorted so grouping
+    on the categorical codes keeps the order of grouping on the strings
+    """
+    import pyarrow as pa
+
+    dictionary = sorted(set(v for v in values if v is not None))
+    codes = {v: i for i, v in enumerate(dictionary)}
+    return pa.DictionaryArray.from_arrays(pa.array([codes.get(v) for v in values], pa.int32()),
+                                          pa.array(dictionary, pa.string()))
+
+
+def write_machine_tables(rows: list, folder_p: str, file_format: str, verbose: bool = True):
+    """
+    Write one typed columnar file per machine, logs_parsed_<machine>.parquet or .arrow (Arrow IPC).
+    time is a timestamp, the counters are integers and machine, benchmark and header are dictionary encoded.
+    The header_<key> columns keep the type given by header_columns.
+    The files are always rewritten with the rows of this run
+    :param rows: rows sorted by sort_rows
+    :param folder_p: output folder
+    :param file_format: "parquet" or "arrow"
+    :param verbose: print the file written for each machine
+    """
+    # pyarrow is only needed for the columnar output
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    column_types = {"time": pa.timestamp("s"), "file_path": pa.string(), HEADER_ID_COLUMN: pa.int64()}
+    for marker in LOG_MARKERS:
+        if marker.kind in ("count", "flag") or marker.value_type is int:
+            column_types[marker.counter] = pa.int64()
+        elif marker.value_type is float:
+            column_types[marker.counter] = pa.float64()
+    dictionary_columns = ["machine", "benchmark", "header"]
+
+    machine_rows = dict()
+    for new_line_dict in rows:
+        machine_rows.setdefault(new_line_dict["machine"], list()).append(new_line_dict)
+
+    for machine_name, m_rows in machine_rows.items():
+        columns = dict()
+        for column in m_rows[0].keys():
+            values = [r[column] for r in m_rows]
+            if column == "time":
+                values = [datetime.strptime(v, CTIME_FORMAT) for v in values]
+            if column in dictionary_columns:
+                columns[column] = dictionary_array(values)
+            elif column not in column_types and column.startswith(HEADER_COLUMN_PREFIX):
+                # Already int, float or str, see header_columns
+                columns[column] = pa.array(values)
+            else:
+                columns[column] = pa.array(values, type=column_types.get(column, pa.string()))
+        table = pa.table(columns)
+        out_file = os.path.join(folder_p, f'logs_parsed_{machine_name}.{file_format}')
+        if file_format == "parquet":
+            pq.write_table(table, out_file)
+        else:
+            with pa.ipc.new_file(out_file, table.schema) as ipc_writer:
+                ipc_writer.write_table(table)
+        if verbose:
+            print(f"Machine {machine_name}: {len(m_rows)} logs in {out_file}")
+
+
+def write_machine_events(entries: list, folder_p: str):
+    """
+    Write the events of all the logs to one events_<machine>.parquet per machine, sorted by time.
+    The time of an event is the timestamp of its line when the line has one, otherwise it is
+    estimated as the log start time plus the AccTime at the event (time_estimated column)
+    :param entries: manifest entries parsed with ParseOptions(events=True)
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    machine_events = dict()
+    for entry in entries:
+        new_line_dict = entry["row"]
+        start_dt = datetime.strptime(new_line_dict["time"], CTIME_FORMAT)
+        for counter, line_number, iteration, acc_time, line_time in entry["events"]:
+            if line_time:
+                event_dt = datetime.fromisoformat(line_time)
+            else:
+                event_dt = start_dt + timedelta(seconds=acc_time)
+            machine_events.setdefault(new_line_dict["machine"], list()).append(
+                (event_dt, new_line_dict["benchmark"], counter, iteration, acc_time, line_number, not line_time,
+                 new_line_dict["file_path"]))
+
+    for machine_name, events in machine_events.items():
+        events.sort(key=lambda e: (e[0], e[7], e[5]))
+        event_dt, benchmark, counter, iteration, acc_time, line_number, time_estimated, file_path = zip(*events)
+        table = pa.table({
+            "time": pa.array(event_dt, pa.timestamp("us")),
+            "machine": dictionary_array([machine_name] * len(events)),
+            "benchmark": dictionary_array(benchmark),
+            "event": dictionary_array(counter),
+            "iteration": pa.array(iteration, pa.int64()),
+            "acc_time": pa.array(acc_time, pa.float64()),
+            "line": pa.array(line_number, pa.int64()),
+            "time_estimated": pa.array(time_estimated, pa.bool_()),
+            "file_path": dictionary_array(file_path),
+        })
+        out_file = os.path.join(folder_p, f'events_{machine_name}.parquet')
+        pq.write_table(table, out_file)
+        print(f"Machine {machine_name}: {len(events)} events in {out_file}")
+
+
+def sqlite_columns(rows: list) -> dict:
+    """
+    SQLite type of each column of the rows, time is stored as ISO text so it sorts and compares as a time.
+    The machines can have different header_<key> columns, the columns are the union of the columns of all the rows
+    """
+    row_columns = list(dict.fromkeys(column for new_line_dict in rows for column in new_line_dict))
+    column_types = {"time": "TEXT", "machine": "TEXT", "benchmark": "TEXT", "file_path": "TEXT",
+                    HEADER_ID_COLUMN: "INTEGER"}
+    for marker in LOG_MARKERS:
+        if marker.kind in ("count", "flag") or marker.value_type is int:
+            column_types[marker.counter] = "INTEGER"
+        elif marker.value_type is float:
+            column_types[marker.counter] = "REAL"
+    for column in row_columns:
+        if column not in column_types and column.startswith(HEADER_COLUMN_PREFIX):
+            value = next((new_line_dict[column] for new_line_dict in rows if new_line_dict.get(column) is not None),
+                         "")
+            column_types[column] = {int: "INTEGER", float: "REAL"}.get(type(value), "TEXT")
+    return {column: column_types.get(column, "TEXT") for column in row_columns}
+
+
+def write_sqlite(rows: list, db_path: str):
+    """
+    Upsert the rows in the runs table of a SQLite database, one row per file_path, so parsing again the same
+    logs updates their rows instead of adding new ones. The counter columns of new markers are added to the table.
+    The headers are interned in the headers table, header_id is its id so it is the same for all the runs
+    :param rows: rows with the header columns of header_columns
+    :param db_path: SQLite database file, created if missing
+    """
+    if not rows:
+        return
+    columns = sqlite_columns(rows=rows)
+    quoted = {column: '"{}"'.format(column.replace('"', '""')) for column in columns}
+    with contextlib.closing(sqlite3.connect(db_path)) as connection:
+        with connection:
+            connection.execute(f"CREATE TABLE IF NOT EXISTS {SQLITE_TABLE} ("
+                               f"file_path TEXT PRIMARY KEY, time TEXT, machine TEXT, benchmark TEXT, header TEXT)")
+            table_columns = {info[1] for info in connection.execute(f"PRAGMA table_info({SQLITE_TABLE})")}
+            for column, column_type in columns.items():
+                if column not in table_columns:
+                    connection.execute(f"ALTER TABLE {SQLITE_TABLE} ADD COLUMN {quoted[column]} {column_type}")
+            connection.execute(f"CREATE INDEX IF NOT EXISTS {SQLITE_TABLE}_machine_benchmark_header_time "
+                               f"ON {SQLITE_TABLE} (machine, benchmark, header, time)")
+            connection.execute(f"CREATE INDEX IF NOT EXISTS {SQLITE_TABLE}_machine_benchmark_header_id_time "
+                               f"ON {SQLITE_TABLE} (machine, benchmark, {HEADER_ID_COLUMN}, time)")
+            connection.execute(f"CREATE TABLE IF NOT EXISTS {SQLITE_HEADERS_TABLE} ("
+                               f"{HEADER_ID_COLUMN} INTEGER PRIMARY KEY, header TEXT UNIQUE NOT NULL)")
+            connection.executemany(f"INSERT OR IGNORE INTO {SQLITE_HEADERS_TABLE} (header) VALUES (?)",
+                                   ((header,) for header in set(new_line_dict["header"] for new_line_dict in rows)
+                                    if header is not None))
+            header_ids = {header: header_id for header_id, header in
+                          connection.execute(f"SELECT {HEADER_ID_COLUMN}, header FROM {SQLITE_HEADERS_TABLE}")}
+
+        upsert = (f"INSERT INTO {SQLITE_TABLE} ({', '.join(quoted.values())}) "
+                  f"VALUES ({', '.join('?' * len(columns))}) ON CONFLICT (file_path) DO UPDATE SET "
+                  + ", ".join(f"{quoted[column]} = excluded.{quoted[column]}"
+                              for column in columns if column != "file_path"))
+        # One transaction per batch, a commit per row would sync the database file for each log
+        for start in range(0, len(rows), SQLITE_BATCH_SIZE):
+            with connection:
+                connection.executemany(upsert, (
+                    [datetime.strptime(new_line_dict["time"], CTIME_FORMAT).isoformat(sep=" ")] +
+                    [header_ids.get(new_line_dict["header"]) if column == HEADER_ID_COLUMN
+                     else new_line_dict.get(column) for column in columns if column != "time"]
+                    for new_line_dict in rows[start:start + SQLITE_BATCH_SIZE]))
+    print(f"{len(rows)} runs written to {db_path}")
+
+
+def write_rows(rows: list, folder_p: str, file_format: str, truncate: bool, verbose: bool = True):
+    """
+    Write the rows to the per machine files in file_format
+    :param rows: rows sorted by sort_rows
+    :param truncate: rewrite the CSVs instead of appending to them, the columnar formats are always rewritten
+    """
+    if file_format == "csv":
+        with MachineCSVWriters(folder_p=folder_p, truncate=truncate, verbose=verbose) as machine_writers:
+            for new_line_dict in rows:
+                machine_writers.writerow(new_line_dict)
+    else:
+        write_machine_tables(rows=rows, folder_p=folder_p, file_format=file_format, verbose=verbose)
+
+
+class WatchedLog:
+    """
+    State of one log followed by LogWatcher: the byte offset already read, the last incomplete line
+    and the scanner with the counters so far
+    """
+    __slots__ = ["offset", "partial", "scanner", "row", "closed"]
+
+    def __init__(self, log_path: str):
+        start_dt, benchmark, machine_name = parse_log_name(log_path)
+        self.offset = 0
+        self.partial = b""
+        self.scanner = LogScanner()
+        self.row = {"time": start_dt, "machine": machine_name, "benchmark": benchmark}
+        self.row.update(self.scanner.counters())
+        self.row["file_path"] = log_path
+        self.closed = False
+
+    def read_new_data(self, log_path: str, size: int):
+        """
+        Scan the lines appended since the last call, the last line is only scanned once it is complete
+        """
+        with open(log_path, "rb") as fp:
+            fp.seek(self.offset)
+            while self.offset < size:
+                chunk = fp.read(min(WATCH_READ_SIZE, size - self.offset))
+                if not chunk:
+                    break
+                self.offset += len(chunk)
+                data = self.partial + chunk
+                complete_size = data.rfind(b"\n") + 1
+                self.partial = data[complete_size:]
+                if complete_size:
+                    self.scanner.feed(io.TextIOWrapper(io.BytesIO(data[:complete_size])))
+        self.row.update(self.scanner.counters())
+
+    def close(self):
+        # A finished log keeps only its row
+        self.scanner = None
+        self.partial = b""
+        self.closed = True
+
+
+def archive_rows(folder_p: str, log_filter: LogFilter = LogFilter()) -> list:
+    """
+    Rows of the logs in the archives under the current dir, so --watch rewrites the per machine files with them.
+    An archive that did not change since the --incremental manifest of folder_p takes its rows from the manifest,
+    the others are streamed once
+    :param folder_p: output folder, with the manifest of the last --incremental run if any
+    :param log_filter: only the logs it selects are kept
+    :return: list with the rows of the archived logs, without the copies
+    """
+    manifest = load_manifest(folder_p=folder_p, events=False)
+    all_archives, _ = discover_logs(log_filter=log_filter)
+    entries = list()
+    for archive_path in all_archives:
+        stat = os.stat(archive_path)
+        archive = manifest["archives"].get(archive_path)
+        if archive and archive["size"] == stat.st_size and archive["mtime"] == stat.st_mtime:
+            entries.extend(entry for log_path, entry in archive["logs"].items() if log_filter.accepts(log_path))
+        else:
+            entries.extend(parse_archive_file(archive_path=archive_path,
+                                              options=ParseOptions(log_filter=log_filter)).values())
+    return [entry["row"] for entry in dedupe_entries(entries)]
+
+
+class LogWatcher:
+    """
+    Follow the loose logs under a dir while they are written, each poll reads only the bytes
+    appended since the previous one. The archives are not followed, their rows are given once
+    """
+
+    def __init__(self, watch_dir: str = ".", log_filter: LogFilter = LogFilter(), fixed_rows: list = None):
+        """
+        :param log_filter: the logs it does not select are not followed
+        :param fixed_rows: rows of the logs that are not followed, e.g. archive_rows, they are returned by rows
+                           unless a followed log has the same file name
+        """
+        self.watch_dir = watch_dir
+        self.log_filter = log_filter
+        self.logs = dict()
+        self.fixed_rows = fixed_rows or list()
+
+    def poll(self) -> set:
+        """
+        Scan the new data of all the logs
+        :return: set with the machines that have new data
+        """
+        changed_machines = set()
+        for dir_entry in walk_files(self.watch_dir):
+            if not dir_entry.name.endswith(".log"):
+                continue
+            log_path = dir_entry.path
+            watched_log = self.logs.get(log_path)
+            if watched_log is None:
+                if not self.log_filter.accepts(log_path):
+                    continue
+                watched_log = self.logs[log_path] = WatchedLog(log_path=log_path)
+            elif watched_log.closed:
+                continue
+            try:
+                size = dir_entry.stat().st_size
+            except FileNotFoundError:
+                continue
+            if size < watched_log.offset:
+                # Truncated or replaced, start again
+                watched_log = self.logs[log_path] = WatchedLog(log_path=log_path)
+            if size == watched_log.offset:
+                # END and nothing appended since the last poll, the log is finished
+                if watched_log.row["#end"]:
+                    watched_log.close()
+                continue
+            watched_log.read_new_data(log_path=log_path, size=size)
+            changed_machines.add(watched_log.row["machine"])
+        return changed_machines
+
+    def rows(self, machines: set = None) -> list:
+        followed_names = set(os.path.basename(log_path) for log_path in self.logs)
+        fixed_rows = [new_line_dict for new_line_dict in self.fixed_rows
+                      if os.path.basename(new_line_dict["file_path"]) not in followed_names]
+        return sort_rows([new_line_dict for new_line_dict in [w.row for w in self.logs.values()] + fixed_rows
+                          if machines is None or new_line_dict["machine"] in machines])
+
+
+def print_machine_totals(rows: list):
+    totals = dict()
+    for new_line_dict in rows:
+        machine_totals = totals.setdefault(new_line_dict["machine"], dict.fromkeys(WATCH_TOTALS, 0))
+        machine_totals["logs"] += 1
+        for counter in WATCH_TOTALS[1:]:
+            machine_totals[counter] += new_line_dict[counter]
+    for machine_name, machine_totals in sorted(totals.items()):
+        print(f"{datetime.now().ctime()} {machine_name}: " +
+              " ".join(f"{counter}={value:g}" for counter, value in machine_totals.items()))
+
+
+def watch_logs(folder_p: str, file_format: str, interval: float, sqlite_path: str = None,
+               log_filter: LogFilter = LogFilter()):
+    """
+    Watch mode, poll the logs every interval seconds and rewrite the files of the machines with new data.
+    The logs of the archives are read once at start and kept in the rewritten files, they are not followed
+    :param sqlite_path: also upsert the rows of the machines with new data in this SQLite database
+    :param log_filter: only the logs it selects are followed
+    """
+    log_watcher = LogWatcher(log_filter=log_filter, fixed_rows=archive_rows(folder_p=folder_p, log_filter=log_filter))
+    print(f"Watching the logs every {interval}s, press Ctrl+C to stop")
+    try:
+        while True:
+            changed_machines = log_watcher.poll()
+            if changed_machines:
+                rows = header_columns(rows=log_watcher.rows(machines=changed_machines))
+                write_rows(rows=rows, folder_p=folder_p, file_format=file_format, truncate=True, verbose=False)
+                if sqlite_path:
+                    write_sqlite(rows=rows, db_path=sqlite_path)
+                print_machine_totals(rows=rows)
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+    rows = log_watcher.rows()
+    print(f"\n\t\tTOTAL_SDC: {sum(new_line_dict['#SDC'] for new_line_dict in rows)}")
 
 
 def main():
-    tmp_dir = "/tmp"
-    folder_p = "logs_parsed"
+    parser = argparse.ArgumentParser(description="Parse the LogHelper logs into per machine CSV files")
+    parser.add_argument("--stream", action="store_true",
+                        help=f"Stream the members of the archives ({', '.join(ARCHIVE_READERS)}) instead of "
+                             f"extracting them to a private dir in --tmp-dir, the loose logs are always read in place")
+    parser.add_argument("--pipeline", action="store_true",
+                        help=f"Read the logs and decompress the archives ahead in {PIPELINE_READ_THREADS} threads "
+                             f"while they are parsed, for slow (e.g. network) storage. The archives are streamed, "
+                             f"as with --stream")
+    parser.add_argument("--output-dir", "-o", default=OUTPUT_DIR,
+                        help=f"Folder of the per machine files and of the {MANIFEST_FILE} (default {OUTPUT_DIR})")
+    parser.add_argument("--tmp-dir", default=TMP_DIR,
+                        help=f"Where the private extraction dir of the run is created, it is removed at the end "
+                             f"(default {TMP_DIR})")
+    parser.add_argument("--shm", action="store_true",
+                        help=f"Extract the archives in memory, on the {SHM_DIR} tmpfs, instead of --tmp-dir")
+    parser.add_argument("--jobs", "-j", type=int, default=1,
+                        help="Number of worker processes used to parse the logs (default 1, serial)")
+    parser.add_argument("--marker", action="append", default=list(), metavar="COUNTER=TOKEN",
+                        help="Count the lines that contain TOKEN in a new COUNTER column, "
+                             "e.g. --marker '#framework_error=CUDA Framework error'")
+    parser.add_argument("--incremental", action="store_true",
+                        help=f"Parse only the logs that are new or changed since the last incremental run, "
+                             f"using the {MANIFEST_FILE} kept in the output dir, and rewrite the CSVs with all the "
+                             f"logs. The logs are read in place, as with --stream")
+    parser.add_argument("--mmap", action="store_true",
+                        help="Scan the raw bytes of the logs on disk through mmap, decoding only the header and "
+                             "the AccTime/AccErr values. Faster for very large logs")
+    parser.add_argument("--format", choices=["csv", "parquet", "arrow"], default="csv",
+                        help="Output format of the per machine files. parquet and arrow (Arrow IPC) write typed "
+                             "columns, need pyarrow and are always rewritten instead of appended (default csv)")
+    parser.add_argument("--sqlite", metavar="DB",
+                        help=f"Also upsert the rows in the {SQLITE_TABLE} table of the SQLite database DB, one row "
+                             f"per file_path, so parsing the same logs again updates their rows")
+    parser.add_argument("--watch", action="store_true",
+                        help="Follow the loose logs while they are written, parsing only the appended lines, "
+                             "and keep the per machine files updated until Ctrl+C. The archives are not followed, "
+                             "their logs are read once at start (from the --incremental manifest when unchanged) "
+                             "and kept in the rewritten files")
+    parser.add_argument("--interval", type=float, default=WATCH_INTERVAL,
+                        help=f"Seconds between two polls of --watch (default {WATCH_INTERVAL})")
+    parser.add_argument("--since", type=datetime.fromisoformat,
+                        help="Only the logs started at or after this time, from their name, e.g. 2021-05-03T10:00")
+    parser.add_argument("--until", type=datetime.fromisoformat,
+                        help="Only the logs started before this time, from their name, e.g. 2021-05-04")
+    parser.add_argument("--benchmark", action="append", default=list(), metavar="PATTERN",
+                        help="Only the logs of the benchmarks matching PATTERN (fnmatch, e.g. 'cuda_*'), "
+                             "can be repeated")
+    parser.add_argument("--exclude-benchmark", action="append", default=list(), metavar="PATTERN",
+                        help="Skip the logs of the benchmarks matching PATTERN, can be repeated")
+    parser.add_argument("--machine", action="append", default=list(), metavar="PATTERN",
+                        help="Only the logs of the machines matching PATTERN, can be repeated")
+    parser.add_argument("--exclude-machine", action="append", default=list(), metavar="PATTERN",
+                        help="Skip the logs of the machines matching PATTERN, can be repeated")
+    parser.add_argument("--stats", action="store_true",
+                        help="Print the wall and CPU time of each stage, the files/s, lines/s and MB/s, "
+                             "and the slowest logs")
+    parser.add_argument("--stats-json", metavar="FILE",
+                        help="Also write the --stats report as JSON to FILE, implies --stats")
+    parser.add_argument("--slowest", type=int, default=STATS_SLOWEST_LOGS,
+                        help=f"Number of slowest logs listed by --stats (default {STATS_SLOWEST_LOGS})")
+    parser.add_argument("--events", action="store_true",
+                        help="Also write events_<machine>.parquet with the time, iteration and AccTime of each "
+                             "SDC, ABORT, reboot and power cycle line, needs pyarrow and the text scanner")
+    args = parser.parse_args()
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    if args.interval <= 0:
+        parser.error("--interval must be positive")
+    if (args.format != "csv" or args.events) and importlib.util.find_spec("pyarrow") is None:
+        parser.error("--format parquet/arrow and --events need pyarrow, install it with: pip install pyarrow")
+    if args.events and (args.mmap or args.watch):
+        parser.error("--events cannot be used with --mmap or --watch")
+    args.stats = args.stats or args.stats_json is not None
+    log_filter = LogFilter(since=args.since, until=args.until, benchmarks=tuple(args.benchmark),
+                           exclude_benchmarks=tuple(args.exclude_benchmark), machines=tuple(args.machine),
+                           exclude_machines=tuple(args.exclude_machine))
+    if args.incremental and log_filter != LogFilter():
+        # The manifest keeps the entries of the unchanged archives, parsed with the filters of the former runs
+        parser.error("--since, --until, --benchmark, --machine and their excludes cannot be used with --incremental")
+    if args.pipeline and (args.incremental or args.watch):
+        parser.error("--pipeline cannot be used with --incremental or --watch")
+    if args.stats and args.watch:
+        parser.error("--stats cannot be used with --watch")
+    if args.slowest < 0:
+        parser.error("--slowest cannot be negative")
+    extra_markers = list()
+    for marker in args.marker:
+        counter, _, token = marker.partition("=")
+        if not counter or not token:
+            parser.error(f"--marker must be COUNTER=TOKEN, got {marker}")
+        extra_markers.append((counter, token))
+    try:
+        register_extra_markers(extra_markers)
+    except ValueError as err:
+        parser.error(str(err))
 
+    tmp_dir = SHM_DIR if args.shm else args.tmp_dir
     if not os.path.isdir(tmp_dir):
-        os.mkdir(tmp_dir)
+        parser.error(f"{tmp_dir} is not a directory")
+    folder_p = args.output_dir
+
+    os.makedirs(folder_p, exist_ok=True)
+
+    if args.watch:
+        watch_logs(folder_p=folder_p, file_format=args.format, interval=args.interval, sqlite_path=args.sqlite,
+                   log_filter=log_filter)
+        return
+
+    run_stats = RunStats()
+    if args.incremental:
+        options = ParseOptions(use_mmap=args.mmap, events=args.events, stats=args.stats)
+        entries = parse_incremental(folder_p=folder_p, jobs=args.jobs, extra_markers=extra_markers, options=options,
+                                    run_stats=run_stats)
+    elif args.pipeline:
+        options = ParseOptions(use_mmap=args.mmap, events=args.events, stats=args.stats, log_filter=log_filter)
+        with run_stats.stage("discover"):
+            all_archives, all_logs_list = discover_logs(log_filter=options.log_filter)
+        # Reads and parsing overlap, both are timed as the parse stage
+        with run_stats.stage("parse"):
+            entries = run_pipeline(all_archives=all_archives, all_logs_list=all_logs_list, jobs=args.jobs,
+                                   extra_markers=extra_markers, options=options)
     else:
-        os.system(f"rm -r -f {tmp_dir}/*")
+        remove_stale_workspaces(tmp_dir=tmp_dir)
+        # The archives are extracted into a dir owned by this run, removed once the logs are parsed
+        with tempfile.TemporaryDirectory(prefix=f"{WORKSPACE_PREFIX}{os.getpid()}_", dir=tmp_dir) as workspace:
+            options = ParseOptions(use_mmap=args.mmap, events=args.events, workspace=workspace, stats=args.stats,
+                                   log_filter=log_filter)
+            tasks = get_parse_tasks(stream=args.stream, jobs=args.jobs, options=options, run_stats=run_stats)
+            with run_stats.stage("parse"):
+                entries = [entry for _, task_entries in run_tasks(tasks=tasks, jobs=args.jobs,
+                                                                  extra_markers=extra_markers)
+                           for entry in task_entries.values()]
+    parsed_entries = entries
+    with run_stats.stage("dedupe"):
+        # The same log can be loose and in an archive, or in several archives
+        entries = dedupe_entries(entries)
+        rows = header_columns(rows=sort_rows([entry["row"] for entry in entries]))
 
-    all_tar = [y for x in os.walk(".") for y in glob.glob(os.path.join(x[0], '*.tar.gz'))]
-    for tar in all_tar:
-        try:
-            if os.system(f"tar -xzf {tar} -C {tmp_dir}/") != 0:
-                raise ValueError
-        except ValueError:
-            os.system(f"gzip -d {tar} -C {tmp_dir}/temp_file.tar")
-            os.system(f"tar -xf {tmp_dir} /temp_file.tar -C {tmp_dir}")
-
-    # Copy some other logs that are not compacted
-    all_logs_list = [y for x in os.walk(".") for y in glob.glob(os.path.join(x[0], '*.log'))]
-    for log in all_logs_list:
-        os.system(f"cp {log} {tmp_dir}/")
-
-    all_logs_tmp = [y for x in os.walk(tmp_dir) for y in glob.glob(os.path.join(x[0], '*.log'))]
-    for log in all_logs_tmp:
-        os.system(f"mv {log} {tmp_dir}/ 2>/dev/null")
-
-    machine_dict = dict()
-
-    total_sdc = 0
-
-    all_logs = [y for x in os.walk(tmp_dir) for y in glob.glob(os.path.join(x[0], '*.log'))]
-
-    all_logs.sort()
-
-    if not os.path.isdir(folder_p):
-        os.mkdir(folder_p)
-
-    for fi in all_logs:
-        log_m = re.match(r'.*/(\d+)_(\d+)_(\d+)_(\d+)_(\d+)_(\d+)_(.*)_(.*).log', fi)
-        if log_m:
-            year = int(log_m.group(1))
-            month = int(log_m.group(2))
-            day = int(log_m.group(3))
-            hour = int(log_m.group(4))
-            minute = int(log_m.group(5))
-            sec = int(log_m.group(6))
-            benchmark = log_m.group(7)
-            machine_name = log_m.group(8)
-
-            start_dt = datetime(year, month, day, hour, minute, sec).ctime()
-            sdc, end, abort, app_crash, sys_crash, acc_time, acc_err = [0] * 7
-            header = None
-
-            with open(fi, "r") as lines:
-                # Only the cannon markers of LogHelper must be added here
-                for line in lines:
-                    header_m = re.match(r".*#HEADER(.*)", line)
-                    if header_m:
-                        header = header_m.group(1).replace(";", "-")
-
-                    # server_header_m = re.match(r".*#SERVER_HEADER(.*)", line)
-                    # elif server_header_m:
-                    #     header = server_header_m.group(1).replace(";", "-")
-
-                    # Continue until a header is found
-                    # This is to guarantee that nothing before of the official header will be counted
-                    if header is None:
-                        continue
-
-                    if re.match(".*SDC.*", line):
-                        sdc += 1
-                        total_sdc += 1
-
-                    acc_time_m = re.match(r".*AccTime:(\d+.\d+)", line)
-                    if acc_time_m:
-                        acc_time = float(acc_time_m.group(1))
-
-                    acc_m = re.match(r".*AccErr:(\d+)", line)
-                    if acc_m:
-                        acc_err = int(acc_m.group(1))
-
-                    # TODO: Add on the log helper a way to write framework errors
-                    if re.match(".*ABORT.*", line):
-                        abort += 1
-                    if re.match(".*soft APP reboot.*", line):
-                        app_crash += 1
-                    if re.match(".*power cycle.*", line):
-                        sys_crash += 1
-                    if re.match(".*END.*", line):
-                        end = 1
-            new_line_dict = {
-                "time": start_dt, "machine": machine_name, "benchmark": benchmark, "header": header, "#SDC": sdc,
-                "#appcrash": app_crash, "#abort": abort, "#syscrash": sys_crash, "#end": end, "acc_err": acc_err,
-                "acc_time": acc_time, "file_path": fi
-            }
-            header_csv = list(new_line_dict.keys())
-            with open(f'./{folder_p}/logs_parsed_{machine_name}.csv', 'a') as fp:
-                csv_writer = csv.DictWriter(fp, fieldnames=header_csv, delimiter=';')
-                if machine_name not in machine_dict:
-                    machine_dict[machine_name] = 1
-                    csv_writer.writeheader()
-                    print(f"Machine first time: {machine_name}")
-                csv_writer.writerow(new_line_dict)
+    total_sdc = sum(new_line_dict["#SDC"] for new_line_dict in rows)
+    with run_stats.stage("write"):
+        # The incremental run rewrites the CSVs with the rows of all the logs
+        write_rows(rows=rows, folder_p=folder_p, file_format=args.format, truncate=args.incremental)
+        if args.events:
+            write_machine_events(entries=entries, folder_p=folder_p)
+        if args.sqlite:
+            write_sqlite(rows=rows, db_path=args.sqlite)
 
     print(f"\n\t\tTOTAL_SDC: {total_sdc}")
 
+    if args.stats:
+        stats = run_stats.report(entries=parsed_entries, slowest=args.slowest, jobs=args.jobs)
+        print_stats(stats=stats)
+        if args.stats_json:
+            with open(args.stats_json, "w") as fp:
+                json.dump(stats, fp, indent=2)
+
 
 if __name__ == '__main__':
     main()
@@ -6,6 +6,18 @@ from datetime import timedelta, datetime
 import os
 import glob
 
+import numpy as np
+import pandas as pd
+
+# Format of the Time column, it is written with datetime.ctime()
+CTIME_FORMAT = "%a %b %d %H:%M:%S %Y"
+# ctime() month names packed as 3 byte integers, sorted, and their month number - 1
+MONTHS = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+MONTH_KEYS, MONTH_ORDER = map(np.array, zip(*sorted((int.from_bytes(month.encode(), "big"), i)
+                                                   for i, month in enumerate(MONTHS))))
+# Length of the summary windows
+SUMMARY_WINDOW_SECONDS = int(timedelta(minutes=60).total_seconds())
+
 
 def main():
     tmp_dir = "/tmp/parserSDC/"
@@ -131,6 +143,8 @@ def main():
     summaries_file = "./" + folder_p + "/summaries.csv"
     os.system("rm -f " + summaries_file)
 
+    # end timestamp of the last summary with more than one line, it is kept for the summaries of a single line
+    end_dt1h = None
     for csvFileName in good_csv_files:
 
         csv_out_file_name = csvFileName.replace(".csv", "_summary.csv")
@@ -138,104 +152,131 @@ def main():
         print("in: " + csvFileName)
         print("out: " + csv_out_file_name)
 
-        # csvFP = open(csvFileName, "r")
-        # csvWFP = open(csvOutFileName, "w")
-        # csvWFP2 = open(summariesFile, "a") # summary
-        with open(csvFileName, "r") as csvFP, open(csv_out_file_name, "w") as csvWFP, open(summaries_file, "a") as csvWFP2:
-
+        with open(csvFileName, "r") as csvFP:
             reader = csv.reader(csvFP, delimiter=';')
+            csv_header = next(reader, None)
+            lines = list(reader)
+
+        with open(csv_out_file_name, "w") as csvWFP, open(summaries_file, "a") as csvWFP2:
             writer = csv.writer(csvWFP, delimiter=';')
             writer2 = csv.writer(csvWFP2, delimiter=';')
 
             writer2.writerow([])
             writer2.writerow([csvFileName])
             header_w2 = ["start timestamp", "end timestamp", "benchmark", "header detail",
-                        "#lines computed", "#SDC", "#AccTime",
-                        "#(Abort==0 and END==0)", "framework_error"]
+                         "#lines computed", "#SDC", "#AccTime",
+                         "#(Abort==0 and END==0)", "framework_error"]
             writer2.writerow(header_w2)
-            ##################
-
-            csv_header = next(reader, None)
 
             writer.writerow(csv_header)
 
-            lines = list(reader)
-
-            i = 0
-            size = len(lines)
-
-            while i < size:
-                if re.match("Time", lines[i][0]):
-                    i += 1
-
-                start_dt = datetime.strptime(lines[i][0].strip(), "%c")
-                ##################summary
-                benchmark = lines[i][2]
-                input_detail = lines[i][3]
-                ##################
-                # print "date in line "+str(i)+": ",startDT
-                j = i
-                acc_time_s = float(lines[i][6])
-                sdc_s = int(lines[i][4])
-                abort_zero_s = 0
-                framework_errors = 0
-
-                if int(lines[i][7]) == 0:
-                    abort_zero_s += 1
-                writer.writerow(lines[i])
-                if i + 1 < size:
-                    try:
-                        if re.match("Time", lines[i + 1][0]):
-                            i += 1
-                        if i + 1 < size:
-
-                            while start_dt - datetime.strptime(lines[i + 1][0], "%c") < timedelta(minutes=60):
-                                if i + 1 == size:
-                                    break
-                                if lines[i + 1][2] != lines[i][2]:  # not the same benchmark
-                                    break
-                                if lines[i + 1][3] != lines[i][3]:  # not the same input
-                                    break
-                                i += 1
-                                ##################summary
-                                end_dt1h = datetime.strptime(lines[i][0], "%c")
-                                ##################
-                                acc_time_s += float(lines[i][6])
-                                sdc_s += int(lines[i][4])
-                                if int(lines[i][7]) == 0 and int(lines[i][8]) == 0:
-                                    abort_zero_s += 1
-
-                                # CUDA framework errors
-                                if int(lines[i][9]) == 1:
-                                    framework_errors += 1
-
-                                writer.writerow(lines[i])
-                                if i == (len(lines) - 1):  # end of lines
-                                    break
-                                if re.match("Time", lines[i + 1][0]):
-                                    i += 1
-                                if i == (len(lines) - 1):  # end of lines
-                                    break
-                    except ValueError as e:
-                        print("date conversion error, detail: " + str(e))
-                        print("date: " + lines[i + 1][0] + "\n")
-                header_c = ["start timestamp", "#lines computed", "#SDC", "#AccTime",
-                           "#(Abort==0 and END==0), CUDA Framework "
-                           "errors"]
+            header_c = ["start timestamp", "#lines computed", "#SDC", "#AccTime",
+                        "#(Abort==0 and END==0), CUDA Framework "
+                        "errors"]
+            for window_rows, summary in summarize_1h_windows(lines):
+                writer.writerows(window_rows)
                 writer.writerow(header_c)
-                row = [start_dt.ctime(), (i - j + 1), sdc_s, acc_time_s, abort_zero_s, framework_errors]
-                writer.writerow(row)
+                start_dt, end_dt, benchmark, input_detail, lines_computed, sdc_s, acc_time_s, abort_zero_s, \
+                    framework_errors = summary
+                writer.writerow([start_dt.ctime(), lines_computed, sdc_s, acc_time_s, abort_zero_s, framework_errors])
                 writer.writerow([])
                 writer.writerow([])
-                ##################summary
-                try:
-                    row2 = [start_dt.ctime(), end_dt1h.ctime(), benchmark, input_detail, (i - j + 1), sdc_s, acc_time_s,
-                            abort_zero_s, framework_errors]
-                    writer2.writerow(row2)
-                except (ValueError, TypeError):
-                    pass
-                ##################
-                i += 1
+                if end_dt is not None:
+                    end_dt1h = end_dt
+                # No summary until a window had more than one line
+                if end_dt1h is not None:
+                    writer2.writerow([start_dt.ctime(), end_dt1h.ctime(), benchmark, input_detail, lines_computed,
+                                      sdc_s, acc_time_s, abort_zero_s, framework_errors])
+
+
+def parse_ctime(values):
+    """
+    Convert the ctime() strings of the Time column, e.g. "Mon May  3 13:13:06 2021", on their fixed
+    character positions. Other strings go through pandas with CTIME_FORMAT
+    :param values: list of strings
+    :return: numpy datetime64[s] array
+    """
+    if all(len(value) == 24 and value.isascii() for value in values):
+        chars = np.array(values, dtype="S24").view(np.uint8).reshape(len(values), 24).astype(np.int64)
+        digits = chars - ord("0")
+        month_keys = (chars[:, 4] << 16) | (chars[:, 5] << 8) | chars[:, 6]
+        month = np.searchsorted(MONTH_KEYS, month_keys)
+        fixed_chars = np.all(chars[:, [3, 7, 10, 19]] == ord(" ")) and np.all(chars[:, [13, 16]] == ord(":"))
+        if fixed_chars and np.all(MONTH_KEYS[np.minimum(month, 11)] == month_keys):
+            year = digits[:, 20] * 1000 + digits[:, 21] * 100 + digits[:, 22] * 10 + digits[:, 23]
+            day = np.where(chars[:, 8] == ord(" "), 0, digits[:, 8]) * 10 + digits[:, 9]
+            seconds = (digits[:, 11] * 10 + digits[:, 12]) * 3600 + (digits[:, 14] * 10 + digits[:, 15]) * 60 \
+                + digits[:, 17] * 10 + digits[:, 18]
+            months = MONTH_ORDER[month]
+            dates = ((year - 1970) * 12 + months).astype("datetime64[M]").astype("datetime64[D]") + (day - 1)
+            return dates.astype("datetime64[s]") + seconds
+    return pd.to_datetime(pd.Series(values).str.strip(), format=CTIME_FORMAT).to_numpy().astype("datetime64[s]")
+
+
+def summarize_1h_windows(lines):
+    """
+    Split the rows of a logs_parsed CSV in windows of consecutive runs with the same benchmark and header,
+    a window ends at a repeated CSV header line or when a run starts one hour or more before the first run
+    of the window. The columns are typed once and the windows are computed with numpy over the whole file
+    :param lines: rows of the CSV without its first header line, it can have other "Time" header lines
+    :return: list of (data rows of the window, (start datetime, end datetime or None for a single line,
+             benchmark, header, #lines computed, #SDC, AccTime, #(Abort==0 and END==0), framework errors))
+    """
+    if not lines:
+        return []
+    frame = pd.DataFrame(lines)
+    is_header = np.array([row[0].startswith("Time") for row in lines])
+    positions = np.flatnonzero(~is_header)
+    data = frame.iloc[positions]
+    times = parse_ctime(data[0].tolist())
+    seconds = times.astype(np.int64)
+    benchmarks = data[2].to_numpy()
+    headers = data[3].to_numpy()
+    sdc = data[4].astype(np.int64).to_numpy()
+    acc_time = data[6].astype(float).to_numpy()
+    abort = data[7].astype(np.int64).to_numpy()
+    end = data[8].astype(np.int64).to_numpy()
+    framework_error = data[9].astype(np.int64).to_numpy()
+
+    # A new benchmark or header, or a header line before the run, always starts a new window
+    after_header = np.concatenate(([True], is_header[:-1]))[positions]
+    new_segment = after_header | np.concatenate(([True], (benchmarks[1:] != benchmarks[:-1]) |
+                                                 (headers[1:] != headers[:-1])))
+    segment_starts = np.flatnonzero(new_segment)
+    segment_ends = np.append(segment_starts[1:], len(positions))
+
+    # Inside a segment a run at least one hour before the first run of the window starts the next window
+    window_starts = list()
+    for start, segment_end in zip(segment_starts, segment_ends):
+        while True:
+            window_starts.append(start)
+            earlier = np.flatnonzero(seconds[start + 1:segment_end] <= seconds[start] - SUMMARY_WINDOW_SECONDS)
+            if not earlier.size:
+                break
+            start += 1 + earlier[0]
+    window_starts = np.array(window_starts)
+    window_ends = np.append(window_starts[1:], len(positions))
+
+    # The first run of a window only counts for #(Abort==0 and END==0) with ABORT==0 and not for the framework errors
+    sdc_s = np.add.reduceat(sdc, window_starts)
+    abort_zero_s = np.add.reduceat((abort == 0) & (end == 0), window_starts) \
+        - ((abort == 0) & (end == 0))[window_starts] + (abort == 0)[window_starts]
+    framework_errors = np.add.reduceat(framework_error == 1, window_starts) - (framework_error == 1)[window_starts]
+    # A header line right after the window is counted as one of its lines
+    last_rows = positions[window_ends - 1]
+    trailing_header = np.append(is_header, False)[last_rows + 1]
+    lines_computed = last_rows + trailing_header - positions[window_starts] + 1
+
+    start_dts = times.tolist()
+    windows = list()
+    for w, (start, window_end) in enumerate(zip(window_starts, window_ends)):
+        # Added in order, as the AccTime is a float sum
+        acc_time_s = np.add.accumulate(acc_time[start:window_end])[-1].item()
+        windows.append(([lines[row] for row in positions[start:window_end]],
+                        (start_dts[start], start_dts[window_end - 1] if window_end - start > 1 else None,
+                         benchmarks[start], headers[start], lines_computed[w].item(), sdc_s[w].item(), acc_time_s,
+                         abort_zero_s[w].item(), framework_errors[w].item())))
+    return windows
 
 
 if __name__ == '__main__':
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+import argparse
+import gzip
+import io
+import os
+import random
+import tarfile
+import time
+import zipfile
+from datetime import datetime, timedelta
+
+# LogHelper file name: YYYY_MM_DD_HH_MM_SS_<benchmark>_<machine>.log
+LOG_NAME_TIME_FORMAT = "%Y_%m_%d_%H_%M_%S"
+# Dir of the logs inside the archives, as on the test machines
+ARCHIVE_LOG_DIR = "var/radiation-benchmarks/log"
+ARCHIVE_TYPES = ["tar.gz", "tar.xz", "tar.bz2", "zip", "log.gz"]
+
+DEFAULT_BENCHMARKS = ["cuda_gemm", "lava", "hotspot", "quicksort"]
+DEFAULT_MACHINES = ["carolk401", "carolk402", "carolx"]
+DEFAULT_HEADERS = {
+    "cuda_gemm": ["size:{size} streams:{streams} -precision:{precision}"],
+    "lava": ["streams:{streams} boxes:{boxes} -precision:{precision}"],
+    "hotspot": ["size:{size} sim_time:{sim_time} streams:{streams} -precision:{precision}"],
+    "quicksort": ["size:{size} -threads:{streams}"],
+}
+# Seconds between two logs of the same machine
+LOG_GAP = 30
+
+
+def generate_log(rng: random.Random, benchmark: str, start_dt: datetime, log_size: int, sdc_rate: float,
+                 abort_rate: float, due_rate: float, end_rate: float):
+    """
+    Build the content of one LogHelper log
+    :param rng: random generator of the run
+    :param benchmark: benchmark name, it selects the header format
+    :param start_dt: start time of the log
+    :param log_size: approximate size of the log in bytes
+    :param sdc_rate: probability of an SDC at each iteration
+    :param abort_rate: probability of the log ending with an ABORT
+    :param due_rate: probability of the log ending with a soft APP reboot or a power cycle
+    :param end_rate: probability of the log ending with an END, if it does not end with an ABORT
+    :return: (log content bytes, dict with the counters the parser should find, seconds the log lasted)
+    """
+    header = rng.choice(DEFAULT_HEADERS.get(benchmark, ["size:{size}"])).format(
+        size=rng.choice([1024, 2048, 4096, 8192]), streams=rng.randint(1, 4), boxes=rng.choice([10, 15, 20]),
+        sim_time=rng.choice([100, 1000]), precision=rng.choice(["float", "double"]))
+    lines = [f"#HEADER {header}",
+             f"#BEGIN Y:{start_dt.year} M:{start_dt.month} D:{start_dt.day} Time:{start_dt:%H:%M:%S}"]
+    counters = {"#SDC": 0, "#appcrash": 0, "#abort": 0, "#syscrash": 0, "#end": 0, "acc_err": 0, "acc_time": 0.0}
+    size = sum(len(line) + 1 for line in lines)
+    kernel_time = rng.uniform(0.05, 2.0)
+    acc_time = 0.0
+    iteration = 0
+    while size < log_size:
+        it_kernel_time = kernel_time * rng.uniform(0.95, 1.05)
+        acc_time += it_kernel_time
+        if rng.random() < sdc_rate:
+            kernel_errors = rng.randint(1, 8)
+            counters["#SDC"] += 1
+            counters["acc_err"] += kernel_errors
+            new_lines = [f"#SDC Ite:{iteration} KerTime:{it_kernel_time:.6f} AccTime:{acc_time:.6f} "
+                         f"KerErr:{kernel_errors} AccErr:{counters['acc_err']}"]
+            new_lines += [f"#ERR p: [{rng.randint(0, 8191)}, {rng.randint(0, 8191)}], r: {rng.uniform(-1, 1):.6e}, "
+                          f"e: {rng.uniform(-1, 1):.6e}" for _ in range(kernel_errors)]
+        else:
+            new_lines = [f"#IT Ite:{iteration} KerTime:{it_kernel_time:.6f} AccTime:{acc_time:.6f}"]
+        lines += new_lines
+        size += sum(len(line) + 1 for line in new_lines)
+        iteration += 1
+    counters["acc_time"] = acc_time
+
+    end_dt = start_dt + timedelta(seconds=acc_time)
+    if rng.random() < abort_rate:
+        lines.append("#ABORT amount of errors equals or greater than 500")
+        counters["#abort"] = 1
+    elif rng.random() < end_rate:
+        lines.append(f"#END Y:{end_dt.year} M:{end_dt.month} D:{end_dt.day} Time:{end_dt:%H:%M:%S}")
+        counters["#end"] = 1
+    if rng.random() < due_rate:
+        if rng.random() < 0.5:
+            lines.append("#SERVER_DUE: soft APP reboot")
+            counters["#appcrash"] = 1
+        else:
+            lines.append("#SERVER_DUE: power cycle")
+            counters["#syscrash"] = 1
+    return "\n".join(lines).encode() + b"\n", counters, acc_time
+
+
+def write_archive(archive_path: str, logs: list):
+    """
+    Write the logs in one archive, the type comes from the suffix of archive_path
+    :param archive_path: path of the archive, one of the ARCHIVE_TYPES
+    :param logs: list of (log name, log content bytes, mtime)
+    """
+    if archive_path.endswith(".zip"):
+        with zipfile.ZipFile(archive_path, "w", compression=zipfile.ZIP_DEFLATED) as zip_file:
+            for log_name, log_data, mtime in logs:
+                zip_info = zipfile.ZipInfo(f"{ARCHIVE_LOG_DIR}/{log_name}", time.localtime(mtime)[:6])
+                zip_info.compress_type = zipfile.ZIP_DEFLATED
+                zip_file.writestr(zip_info, log_data)
+        return
+    with tarfile.open(archive_path, f"w:{archive_path.rpartition('.')[2]}") as tar:
+        for log_name, log_data, mtime in logs:
+            tar_info = tarfile.TarInfo(f"{ARCHIVE_LOG_DIR}/{log_name}")
+            tar_info.size = len(log_data)
+            tar_info.mtime = mtime
+            tar.addfile(tar_info, io.BytesIO(log_data))
+
+
+def generate_logs(output_dir: str, files: int, log_size: int, sdc_rate: float, abort_rate: float,
+                  due_rate: float, end_rate: float, benchmarks: list, machines: list, start_dt: datetime,
+                  archive: str = None, logs_per_archive: int = 50, seed: int = 0) -> dict:
+    """
+    Write a synthetic campaign of LogHelper logs, one dir per machine
+    :param archive: None to write loose logs, or one of ARCHIVE_TYPES to compress them
+    :param logs_per_archive: number of logs in each tar/zip archive
+    :return: dict with the number of logs, the bytes of the logs and the totals the parser should find
+    """
+    rng = random.Random(seed)
+    totals = {"logs": 0, "bytes": 0, "#SDC": 0, "#appcrash": 0, "#abort": 0, "#syscrash": 0, "#end": 0}
+    machine_dt = {machine: start_dt for machine in machines}
+    machine_logs = {machine: list() for machine in machines}
+    for i in range(files):
+        machine = machines[i % len(machines)]
+        benchmark = rng.choice(benchmarks)
+        log_dt = machine_dt[machine]
+        log_data, counters, duration = generate_log(rng=rng, benchmark=benchmark, start_dt=log_dt,
+                                                    log_size=log_size, sdc_rate=sdc_rate, abort_rate=abort_rate,
+                                                    due_rate=due_rate, end_rate=end_rate)
+        machine_dt[machine] = log_dt + timedelta(seconds=int(duration) + LOG_GAP)
+        log_name = f"{log_dt.strftime(LOG_NAME_TIME_FORMAT)}_{benchmark}_{machine}.log"
+        machine_logs[machine].append((log_name, log_data, int(log_dt.timestamp() + duration)))
+        totals["logs"] += 1
+        totals["bytes"] += len(log_data)
+        for counter in ["#SDC", "#appcrash", "#abort", "#syscrash", "#end"]:
+            totals[counter] += counters[counter]
+
+    for machine, logs in machine_logs.items():
+        machine_dir = os.path.join(output_dir, machine)
+        os.makedirs(machine_dir, exist_ok=True)
+        if archive is None:
+            for log_name, log_data, mtime in logs:
+                log_path = os.path.join(machine_dir, log_name)
+                with open(log_path, "wb") as fp:
+                    fp.write(log_data)
+                os.utime(log_path, (mtime, mtime))
+        elif archive == "log.gz":
+            for log_name, log_data, mtime in logs:
+                with open(os.path.join(machine_dir, f"{log_name}.gz"), "wb") as fp:
+                    fp.write(gzip.compress(log_data, mtime=mtime))
+        else:
+            for i in range(0, len(logs), logs_per_archive):
+                write_archive(archive_path=os.path.join(machine_dir, f"{machine}_{i // logs_per_archive}.{archive}"),
+                              logs=logs[i:i + logs_per_archive])
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic LogHelper logs to test and benchmark "
+                                                 "first_parser_sdc-csv-generator.py")
+    parser.add_argument("output_dir", help="Dir where the logs are written, one sub dir per machine")
+    parser.add_argument("--files", type=int, default=100, help="Number of logs (default 100)")
+    parser.add_argument("--log-size", type=int, default=64 << 10,
+                        help="Approximate size of each log in bytes (default 65536)")
+    parser.add_argument("--sdc-rate", type=float, default=0.01,
+                        help="Probability of an SDC at each iteration (default 0.01)")
+    parser.add_argument("--abort-rate", type=float, default=0.05,
+                        help="Probability of a log ending with an ABORT (default 0.05)")
+    parser.add_argument("--due-rate", type=float, default=0.05,
+                        help="Probability of a soft APP reboot or power cycle after a log (default 0.05)")
+    parser.add_argument("--end-rate", type=float, default=0.9,
+                        help="Probability of a log that was not aborted ending with an END (default 0.9)")
+    parser.add_argument("--benchmarks", nargs="+", default=DEFAULT_BENCHMARKS, help="Benchmark names")
+    parser.add_argument("--machines", nargs="+", default=DEFAULT_MACHINES, help="Machine names")
+    parser.add_argument("--start", type=datetime.fromisoformat, default=datetime(2021, 5, 3, 10, 0, 0),
+                        help="Start time of the campaign, e.g. 2021-05-03T10:00:00")
+    parser.add_argument("--archive", choices=ARCHIVE_TYPES,
+                        help="Compress the logs of each machine instead of writing them loose")
+    parser.add_argument("--logs-per-archive", type=int, default=50,
+                        help="Number of logs in each tar/zip archive (default 50)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the random generator (default 0)")
+    args = parser.parse_args()
+    if args.files < 1 or args.log_size < 1 or args.logs_per_archive < 1:
+        parser.error("--files, --log-size and --logs-per-archive must be positive")
+    for rate in ["sdc_rate", "abort_rate", "due_rate", "end_rate"]:
+        if not 0 <= getattr(args, rate) <= 1:
+            parser.error(f"--{rate.replace('_', '-')} must be between 0 and 1")
+    if any("_" in machine for machine in args.machines):
+        parser.error("The machine names cannot have '_', it separates the benchmark from the machine")
+
+    totals = generate_logs(output_dir=args.output_dir, files=args.files, log_size=args.log_size,
+                           sdc_rate=args.sdc_rate, abort_rate=args.abort_rate, due_rate=args.due_rate,
+                           end_rate=args.end_rate, benchmarks=args.benchmarks, machines=args.machines,
+                           start_dt=args.start, archive=args.archive, logs_per_archive=args.logs_per_archive,
+                           seed=args.seed)
+    print(f"Generated {totals['logs']} logs, {totals['bytes'] / 1e6:.1f} MB in {args.output_dir}")
+    print(f"\n\t\tTOTAL_SDC: {totals['#SDC']}")
+
+
+if __name__ == '__main__':
+    main()